@@ -0,0 +1,316 @@
+"""
+End-to-end benchmark of the Cosential extract path against the local mock API (see mock_cosential.py).
+
+For each size, the mock server is started with that many changed objects. The script then runs the DAG's
+`plan_entity_shards` task for one entity and the `process_entity` task of every planned shard (one after
+another) in this process, and reports wall time, requests/sec and peak memory (resident, or traced Python
+allocations with --memory tracemalloc) for each.
+
+By default, landed blobs go to an in-memory container, so only the API and serialization are measured.
+Part files are counted but not kept. With --storage azure, the container in BLOB_CONTAINER of the
+configured storage account is used instead.
+
+Run it from the repository root inside the Airflow image (e.g. `astro dev bash`):
+    python benchmarks/benchmark_extract.py --sizes 1000 10000 100000
+"""
+
+import argparse
+import json
+import os
+import socket
+import resource
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+import requests
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class MemoryBlob:
+    """Blob client of MemoryContainer. Part files are counted, everything else is kept."""
+
+    def __init__(self, container, name):
+        self.container = container
+        self.name = name
+
+    def upload_blob(self, data, overwrite=False, **kwargs):
+        if isinstance(data, str):
+            data = data.encode('UTF-8')
+        if isinstance(data, bytes):
+            chunks = [data]
+        elif hasattr(data, 'read'):
+            chunks = iter(lambda: data.read(4 * 1024 * 1024), b'')
+        else:
+            chunks = (chunk.encode('UTF-8') if isinstance(chunk, str) else chunk for chunk in data)
+
+        if '/parts/' in self.name:
+            self.container.uploaded_bytes += sum(len(chunk) for chunk in chunks)
+            self.container.blobs[self.name] = b''
+        else:
+            self.container.blobs[self.name] = b''.join(chunks)
+            self.container.uploaded_bytes += len(self.container.blobs[self.name])
+
+    def stage_block(self, block_id, data, **kwargs):
+        blocks = self.container.staged.setdefault(self.name, {})
+        if '/parts/' in self.name:
+            self.container.uploaded_bytes += len(data)
+            data = b''
+        blocks[block_id] = data
+
+    def commit_block_list(self, block_list, **kwargs):
+        blocks = self.container.staged.pop(self.name, {})
+        self.container.blobs[self.name] = b''.join(blocks[block_id] for block_id in block_list)
+        if '/parts/' not in self.name:
+            self.container.uploaded_bytes += len(self.container.blobs[self.name])
+
+    def download_blob(self, **kwargs):
+        from azure.core.exceptions import ResourceNotFoundError
+
+        if self.name not in self.container.blobs:
+            raise ResourceNotFoundError(f'{self.name} not found')
+        return MemoryDownload(self.container.blobs[self.name])
+
+    def get_blob_properties(self):
+        return type('BlobProperties', (), {'etag': str(hash(self.download_blob().readall()))})()
+
+
+class MemoryDownload:
+    def __init__(self, data):
+        self.data = data
+
+    def readall(self):
+        return self.data
+
+    def chunks(self):
+        for offset in range(0, len(self.data), 4 * 1024 * 1024):
+            yield self.data[offset:offset + 4 * 1024 * 1024]
+
+    def readinto(self, stream):
+        stream.write(self.data)
+        return len(self.data)
+
+
+class MemoryContainer:
+    """Stand-in for azure.storage.blob.ContainerClient that keeps blobs in memory."""
+
+    account_name = 'benchmark'
+
+    def __init__(self):
+        self.blobs = {}
+        self.staged = {}
+        self.uploaded_bytes = 0
+
+    def get_blob_client(self, name):
+        return MemoryBlob(self, name)
+
+    def list_blobs(self, name_starts_with=''):
+        return [type('BlobProperties', (), {'name': name})() for name in sorted(self.blobs) if name.startswith(name_starts_with)]
+
+
+class TaskInstance:
+    """Minimal task instance holding the XComs the benchmarked tasks pull and push."""
+
+    def __init__(self, xcoms):
+        self.xcoms = xcoms
+
+    def xcom_pull(self, task_ids=None, key='return_value'):
+        return self.xcoms.get((task_ids, key))
+
+    def xcom_push(self, key, value):
+        self.xcoms[(None, key)] = value
+
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_mock_server(port, object_count, args):
+    """
+    Starts the mock API in a separate process, so it does not compete with the benchmark for the GIL.
+
+    Args:
+        port (int): The port to listen on.
+        object_count (int): The number of objects, all of them changed since version 0.
+        args (argparse.Namespace): The benchmark arguments.
+
+    Returns:
+        subprocess.Popen: The server process.
+    """
+    env = dict(
+        os.environ,
+        MOCK_OBJECT_COUNT=str(object_count),
+        MOCK_ARRAY_LENGTH=str(args.array_length),
+        MOCK_LATENCY_MS=str(args.latency_ms),
+        MOCK_ERROR_RATE=str(args.error_rate),
+        MOCK_RATE_LIMIT=str(args.rate_limit),
+        MOCK_DELETED_RATE=str(args.deleted_rate),
+        MOCK_FIXTURES_DIR=args.fixtures_dir or '',
+        MOCK_EMBEDDED_ARRAYS=','.join(args.arrays) if args.embedded_arrays else '',
+    )
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'benchmarks.mock_cosential:app', '--port', str(port), '--log-level', 'warning'],
+        cwd=repo_root,
+        env=env,
+    )
+
+    for _ in range(100):
+        try:
+            requests.get(f'http://127.0.0.1:{port}/_stats', timeout=1)
+            return server
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+
+    server.kill()
+    raise RuntimeError('The mock Cosential API did not start')
+
+
+def get_rss():
+    """Returns the resident memory of this process in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(task, base_url, memory='rss'):
+    """
+    Runs a task and measures it.
+
+    Peak memory is either the highest resident memory sampled while the task runs (`rss`), or the peak of
+    Python allocations traced by tracemalloc (`tracemalloc`), which is exact but slows the task down several times.
+
+    Args:
+        task (callable): The task to run.
+        base_url (str): The URL of the mock API.
+        memory (str): How peak memory is measured, `rss` or `tracemalloc`.
+
+    Returns:
+        tuple: The result of the task and a dictionary of measurements.
+    """
+    requests.delete(f'{base_url}_stats')
+
+    peak = {'rss': get_rss()}
+    done = threading.Event()
+
+    def sample_rss():
+        while not done.wait(0.05):
+            peak['rss'] = max(peak['rss'], get_rss())
+
+    if memory == 'tracemalloc':
+        tracemalloc.start()
+    else:
+        sampler = threading.Thread(target=sample_rss, daemon=True)
+        sampler.start()
+
+    started = time.perf_counter()
+    try:
+        result = task()
+    finally:
+        wall_time = time.perf_counter() - started
+        done.set()
+        if memory == 'tracemalloc':
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        else:
+            sampler.join()
+            peak_memory = max(peak['rss'], get_rss())
+
+    stats = requests.get(f'{base_url}_stats').json()
+
+    return result, {
+        'wall_time_s': round(wall_time, 3),
+        'requests': stats.get('requests', 0),
+        'requests_per_s': round(stats.get('requests', 0) / wall_time, 1) if wall_time else None,
+        'errors': stats.get('errors', 0) + stats.get('rate_limited', 0),
+        'peak_memory_mb': round(peak_memory / 1024 / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='Changed IDs per run')
+    parser.add_argument('--entity', default='Opportunities', help='Entity name')
+    parser.add_argument('--endpoint', default='opportunities', help='Entity endpoint')
+    parser.add_argument('--strategy', choices=['per_id', 'bulk'], help='Extraction strategy (chosen by the DAG when omitted)')
+    parser.add_argument('--arrays', nargs='*', default=['Offices'], help='Arrays pulled for every object')
+    parser.add_argument('--embedded-arrays', action='store_true', help='Embed the arrays in the object payloads and map them')
+    parser.add_argument('--array-length', type=int, default=3, help='Items per synthetic array')
+    parser.add_argument('--latency-ms', type=float, default=20, help='Mock API latency per request')
+    parser.add_argument('--error-rate', type=float, default=0, help='Share of requests answered with 503')
+    parser.add_argument('--rate-limit', type=float, default=0, help='Requests/sec before 429s (0 = unlimited)')
+    parser.add_argument('--deleted-rate', type=float, default=0, help='Share of objects flagged as deleted')
+    parser.add_argument('--fixtures-dir', help='Directory of recorded fixtures (see mock_cosential.py)')
+    parser.add_argument('--storage', choices=['memory', 'azure'], default='memory', help='Where landed blobs go')
+    parser.add_argument('--memory', choices=['rss', 'tracemalloc'], default='rss', help='How peak memory is measured')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    port = get_free_port()
+    base_url = f'http://127.0.0.1:{port}/'
+
+    # The DAG modules read their configuration on import
+    os.environ['COSENTIAL_BASE_URL'] = base_url
+    os.environ.setdefault('BLOB_CONTAINER', 'benchmark')
+    os.environ.setdefault('SOURCE_NAME', 'benchmark')
+    os.environ.setdefault('AIRFLOW__CORE__DAGS_FOLDER', os.path.join(repo_root, 'dags'))
+    sys.path.insert(0, os.path.join(repo_root, 'dags'))
+
+    from plugins import api_utils, azure_utils
+
+    api_utils.get_secret = lambda secret_name: 'benchmark'
+    if args.storage == 'memory':
+        container = MemoryContainer()
+        azure_utils.get_container_client = lambda container_name: container
+
+    import CosentialDAG
+
+    entity = {'Entity': args.entity, 'Endpoint': args.endpoint}
+    if args.strategy:
+        entity.update(ExtractionStrategy=args.strategy, IdField='Id')
+    arrays = [{'Entity': args.entity, 'Arrays': args.arrays}]
+    if args.embedded_arrays:
+        arrays[0]['Mappings'] = {array: f'$.{array}[*]' for array in args.arrays}
+
+    results = []
+    for size in args.sizes:
+        server = start_mock_server(port, size, args)
+        try:
+            ti = TaskInstance({('get_versions', 'versions'): {args.entity: 0}, ('get_arrays', 'entity_arrays'): arrays})
+            blob_path = f'benchmark/size={size}'
+
+            plan, plan_metrics = measure(lambda: CosentialDAG.plan_entity_shards(entity, ti=ti, blob_path=blob_path), base_url, args.memory)
+            # Run every shard of the plan with its kwargs, as the mapped DAG tasks would (one after another here)
+            handles, process_metrics = measure(
+                lambda: [CosentialDAG.process_entity(**shard_kwargs, ti=ti, run_id=f'benchmark-{size}') for shard_kwargs in plan],
+                base_url, args.memory,
+            )
+        finally:
+            server.terminate()
+            server.wait()
+
+        result = {'size': size, 'shards': len(plan), 'objects': sum(handle['objects'] for handle in handles), 'plan': plan_metrics, 'process': process_metrics}
+        results.append(result)
+        print(json.dumps(result), flush=True)
+
+    print()
+    print(f"{'size':>8} {'task':>8} {'wall s':>8} {'requests':>9} {'req/s':>8} {'errors':>7} {'peak MB':>8}")
+    for result in results:
+        for task in ('plan', 'process'):
+            metrics = result[task]
+            print(f"{result['size']:>8} {task:>8} {metrics['wall_time_s']:>8} {metrics['requests']:>9} "
+                  f"{metrics['requests_per_s']:>8} {metrics['errors']:>7} {metrics['peak_memory_mb']:>8}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""
+Local stand-in for the Cosential API, so the extract path can be measured without calling compass.cosential.com.
+
+Serves the routes used by plugins/api_utils.py for any endpoint prefix:
+
+- {endpoint}/changes?version=&includeDeleted=&reverse=   the change feed
+- {endpoint}                                             the paged object list
+- {endpoint}/{id}                                        a single object
+- {endpoint}/{id}/{array}                                an object's array
+
+List routes honour SIZE/FROM paging. Objects 1..MOCK_OBJECT_COUNT exist for every endpoint, and object N has Version N.
+Payloads are synthetic, or copied from recorded fixtures when MOCK_FIXTURES_DIR holds `{endpoint}.json` (a list of
+objects, served round-robin with the ID replaced) and `{endpoint}.{array}.json` (an array served for every object).
+Arrays named in MOCK_EMBEDDED_ARRAYS are embedded in the object payloads as well.
+
+Run it with:
+    uvicorn benchmarks.mock_cosential:app --port 8081
+and point the DAG at it with COSENTIAL_BASE_URL=http://localhost:8081/.
+"""
+
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+
+@dataclass
+class MockConfig:
+    """Behaviour of the mock API, read from MOCK_* environment variables."""
+
+    object_count: int = int(os.getenv('MOCK_OBJECT_COUNT', '1000'))
+    array_length: int = int(os.getenv('MOCK_ARRAY_LENGTH', '3'))
+    embedded_arrays: tuple = tuple(name for name in os.getenv('MOCK_EMBEDDED_ARRAYS', '').split(',') if name)
+    deleted_rate: float = float(os.getenv('MOCK_DELETED_RATE', '0'))
+    latency_ms: float = float(os.getenv('MOCK_LATENCY_MS', '20'))
+    latency_jitter_ms: float = float(os.getenv('MOCK_LATENCY_JITTER_MS', '5'))
+    error_rate: float = float(os.getenv('MOCK_ERROR_RATE', '0'))
+    rate_limit: float = float(os.getenv('MOCK_RATE_LIMIT', '0'))
+    max_page_size: int = int(os.getenv('MOCK_MAX_PAGE_SIZE', '1000'))
+    fixtures_dir: str = os.getenv('MOCK_FIXTURES_DIR', '')
+    seed: int = int(os.getenv('MOCK_SEED', '42'))
+    fixtures: dict = field(default_factory=dict)
+
+
+config = MockConfig()
+stats = Counter()
+random_source = random.Random(config.seed)
+
+_bucket = {'tokens': config.rate_limit, 'updated': time.monotonic()}
+_bucket_lock = threading.Lock()
+
+app = FastAPI(title='Mock Cosential API')
+
+
+def load_fixture(name):
+    """
+    Loads a recorded fixture from MOCK_FIXTURES_DIR, once.
+
+    Args:
+        name (str): The file name of the fixture.
+
+    Returns:
+        list | None: The fixture records, or None if there is no such fixture.
+    """
+    if name not in config.fixtures:
+        path = os.path.join(config.fixtures_dir, name)
+        if config.fixtures_dir and os.path.exists(path):
+            with open(path) as f:
+                config.fixtures[name] = json.load(f)
+        else:
+            config.fixtures[name] = None
+    return config.fixtures[name]
+
+
+def fixture_name(endpoint):
+    return endpoint.strip('/').replace('/', '_')
+
+
+def singular(name):
+    """Returns the singular of an entity or array name, e.g. Opportunities -> Opportunity, Offices -> Office."""
+    if name.endswith('ies'):
+        return f'{name[:-3]}y'
+    if name.endswith('s') and not name.endswith('ss'):
+        return name[:-1]
+    return name
+
+
+def is_deleted(object_id):
+    return config.deleted_rate > 0 and (object_id * 2654435761) % 1000 < config.deleted_rate * 1000
+
+
+def make_object(endpoint, object_id):
+    """
+    Returns the payload of one object.
+
+    Args:
+        endpoint (str): The endpoint prefix.
+        object_id (int): The object ID.
+
+    Returns:
+        dict: The object, with the ID under `Id` and `{Entity}Id` (e.g. OpportunityId).
+    """
+    entity = fixture_name(endpoint).split('_')[-1].capitalize()
+    id_field = f"{singular(entity)}Id"
+
+    recorded = load_fixture(f'{fixture_name(endpoint)}.json')
+    if recorded:
+        payload = dict(recorded[(object_id - 1) % len(recorded)])
+    else:
+        payload = {
+            'Name': f'{entity} {object_id}',
+            'Description': 'x' * (32 + object_id % 96),
+            'Amount': round(object_id * 1.5, 2),
+            'IsActive': object_id % 2 == 0,
+            'CreateDate': '2024-01-01T00:00:00',
+            'ModifyDate': '2024-06-01T00:00:00',
+        }
+
+    payload['Id'] = object_id
+    payload[id_field] = object_id
+    payload['Version'] = object_id
+
+    # Arrays listed in MOCK_EMBEDDED_ARRAYS are also part of the object payload
+    for array_name in config.embedded_arrays:
+        payload[array_name] = make_array(endpoint, object_id, array_name)
+    return payload
+
+
+def make_array(endpoint, object_id, array_name):
+    """
+    Returns the items of one object's array.
+
+    Args:
+        endpoint (str): The endpoint prefix.
+        object_id (int): The object ID.
+        array_name (str): The name of the array.
+
+    Returns:
+        list: The array items.
+    """
+    recorded = load_fixture(f'{fixture_name(endpoint)}.{array_name}.json')
+    if recorded is not None:
+        return [dict(item) for item in recorded]
+
+    item_name = singular(array_name)
+    return [
+        {f'{item_name}Id': object_id * 100 + index, f'{item_name}Name': f'{array_name} {index}', 'IsPrimary': index == 0}
+        for index in range(config.array_length)
+    ]
+
+
+def get_live_ids():
+    """
+    Returns the IDs of the objects that are not deleted, in ascending order.
+
+    Returns:
+        list: The object IDs.
+    """
+    key = ('live_ids', config.object_count, config.deleted_rate)
+    if key not in config.fixtures:
+        config.fixtures[key] = [object_id for object_id in range(1, config.object_count + 1) if not is_deleted(object_id)]
+    return config.fixtures[key]
+
+
+def get_page(request, items):
+    """
+    Applies SIZE/FROM paging to a list of items, capped at MOCK_MAX_PAGE_SIZE.
+
+    Args:
+        request (fastapi.Request): The request.
+        items (list | range): The items to page through.
+
+    Returns:
+        list | range: The items of the requested page.
+    """
+    size = min(int(request.query_params.get('SIZE', 50)), config.max_page_size)
+    offset = int(request.query_params.get('FROM', 0))
+    return items[offset:offset + size]
+
+
+def take_rate_limit_token():
+    """
+    Takes a token from the rate limit bucket.
+
+    Returns:
+        float: 0 if the request may proceed, otherwise the seconds until a token is available.
+    """
+    if config.rate_limit <= 0:
+        return 0
+
+    with _bucket_lock:
+        now = time.monotonic()
+        _bucket['tokens'] = min(config.rate_limit, _bucket['tokens'] + (now - _bucket['updated']) * config.rate_limit)
+        _bucket['updated'] = now
+        if _bucket['tokens'] >= 1:
+            _bucket['tokens'] -= 1
+            return 0
+        return (1 - _bucket['tokens']) / config.rate_limit
+
+
+@app.get('/_stats')
+def get_stats():
+    return dict(stats)
+
+
+@app.delete('/_stats')
+def reset_stats():
+    stats.clear()
+    return {}
+
+
+@app.get('/{path:path}')
+async def cosential(path: str, request: Request):
+    segments = path.strip('/').split('/')
+    stats['requests'] += 1
+
+    wait = take_rate_limit_token()
+    if wait:
+        stats['rate_limited'] += 1
+        return Response(status_code=429, headers={'Retry-After': f'{wait:.3f}'})
+
+    if config.latency_ms or config.latency_jitter_ms:
+        delay = config.latency_ms + random_source.uniform(-1, 1) * config.latency_jitter_ms
+        await asyncio.sleep(max(0, delay) / 1000)
+
+    if config.error_rate and random_source.random() < config.error_rate:
+        stats['errors'] += 1
+        return Response(status_code=503)
+
+    # {endpoint}/changes
+    if segments[-1] == 'changes':
+        stats['changes'] += 1
+        version = int(request.query_params.get('version', 0))
+        reverse = request.query_params.get('reverse', 'false').lower() == 'true'
+        include_deleted = request.query_params.get('includeDeleted', 'false').lower() == 'true'
+
+        if include_deleted:
+            versions = range(version + 1, config.object_count + 1)
+        else:
+            versions = [object_id for object_id in get_live_ids() if object_id > version]
+        if reverse:
+            versions = versions[::-1]
+
+        changes = [
+            {'Id': object_id, 'Version': object_id, 'IsDeleted': is_deleted(object_id)}
+            for object_id in get_page(request, versions)
+        ]
+        return JSONResponse(changes)
+
+    # {endpoint}/{id}/{array}
+    if len(segments) >= 3 and segments[-2].isdigit():
+        stats['arrays'] += 1
+        object_id = int(segments[-2])
+        if not 1 <= object_id <= config.object_count or is_deleted(object_id):
+            return Response(status_code=404)
+        return JSONResponse(get_page(request, make_array('/'.join(segments[:-2]), object_id, segments[-1])))
+
+    # {endpoint}/{id}
+    if len(segments) >= 2 and segments[-1].isdigit():
+        stats['objects'] += 1
+        object_id = int(segments[-1])
+        if not 1 <= object_id <= config.object_count or is_deleted(object_id):
+            return Response(status_code=404)
+        return JSONResponse(make_object('/'.join(segments[:-1]), object_id))
+
+    # {endpoint}
+    stats['lists'] += 1
+    endpoint = '/'.join(segments)
+    return JSONResponse([make_object(endpoint, object_id) for object_id in get_page(request, get_live_ids())])
@@ -1,7 +1,10 @@
 # Standard library imports
+import hashlib
 import json
 import logging
+import math
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 # Third-party imports
@@ -12,18 +15,25 @@ from airflow.operators.dummy import DummyOperator
 from airflow.operators.python import PythonOperator
 from airflow.utils.dates import days_ago
 from airflow.utils.task_group import TaskGroup
-from azure.storage.blob import BlobServiceClient
 
 # Local application imports
-from plugins.api_utils import fetch_changed_ids, pull_entity_objects, pull_entity_arrays, update_latest_version
-from plugins.azure_utils import read_from_azure_storage, get_secret, write_data_azure_storage, write_data_azure_sql
+from plugins import metrics
+from plugins.flatten_utils import get_array_mappings, iter_flattened
+from plugins.schema_utils import get_table_plans
+from plugins.stream_utils import iter_prefetched, iter_fanout
+from plugins.api_utils import fetch_changed_ids, iter_entity_objects, iter_entity_arrays, update_latest_version, choose_extraction_strategy
+from plugins.azure_utils import (
+    read_from_azure_storage, get_secret, write_data_azure_storage, write_data_azure_sql, merge_data_azure_sql, load_metadata_snapshot,
+    get_container_client, landing_blob_name, landing_format, iter_landed_records, manifest_blob_name, assemble_blob,
+    write_parquet, write_parquet_azure_storage, iter_rows_parquet_azure_storage,
+)
 
 
 blob_container = os.environ['BLOB_CONTAINER']
 
-# Read metadata from Azure Storage
-entities = read_from_azure_storage(blob_container, 'metadata/cosential_entities.json')
-schema = read_from_azure_storage(blob_container, 'metadata/Cosential_Table_Schemas.json')
+# Read metadata through local snapshots so that parsing the DAG does not wait on Azure Storage
+entities = load_metadata_snapshot(blob_container, 'metadata/cosential_entities.json', default=[])
+schema = load_metadata_snapshot(blob_container, 'metadata/Cosential_Table_Schemas.json', default={'Entities': []})
 
 # Set up environment variables and paths
 airflow_home = os.environ['AIRFLOW_HOME']
@@ -47,11 +57,20 @@ blob_path = os.path.join(f"year={year}", f"month={month}", f"day={day}")
 # Temporary file name
 hour = 'temp'
 
+# Task group holding the per-entity tasks
+entities_group_id = 'process_entities'
 
-def count_files_with_prefix(blob_path, connection_string):
+# Changed IDs per extraction shard (overridable per entity with ShardSize), and the maximum number of shards
+shard_size = int(os.getenv('SHARD_SIZE', '2000'))
+max_shards = int(os.getenv('MAX_SHARDS', '16'))
 
-    blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-    container_client = blob_service_client.get_container_client(blob_container)
+# Changed IDs landed and checkpointed together within a shard (overridable per entity with CheckpointSize)
+checkpoint_size = int(os.getenv('CHECKPOINT_SIZE', '500'))
+
+
+def count_files_with_prefix(blob_path):
+
+    container_client = get_container_client(blob_container)
 
     prefix = f'{blob_path}/run='
     blob_list = container_client.list_blobs(name_starts_with=prefix)
@@ -67,11 +86,14 @@ def create_dynamic_tasks():
     """
     Creates dynamic tasks for processing entities and their tables.
 
-    This function iterates over a list of entities and creates two PythonOperator tasks for each entity:
-    - process_entity_task: Executes the `process_entity` function with the given entity and blob_path as arguments.
+    This function iterates over a list of entities and creates the following tasks for each entity:
+    - plan_entity_shards_task: Executes the `plan_entity_shards` function, which fetches the changed IDs and splits them into shards.
+    - process_entity_task: Executes the `process_entity` function once per shard, using dynamic task mapping.
+    - merge_entity_shards_task: Executes the `merge_entity_shards` function, which writes the manifests of the landed part files.
     - process_entity_tables_task: Executes the `process_entity_tables` function with the given schema and entity_name as arguments.
 
-    The `process_entity_task` is set as the upstream task for the `process_entity_tables_task`.
+    The tasks run in that order. When WRITE_PARQUET is enabled, a land_entity_parquet task runs
+    between the merge and the `process_entity_tables_task`.
 
     Parameters:
         None
@@ -82,10 +104,22 @@ def create_dynamic_tasks():
     for entity in entities:
         entity_name = entity['Entity']
 
-        process_entity_task = PythonOperator(
+        plan_entity_shards_task = PythonOperator(
+            task_id=f'plan_entity_shards_{entity_name}',
+            python_callable=plan_entity_shards,
+            op_kwargs={'entity': entity, 'blob_path': blob_path},
+        )
+
+        # One mapped task instance per shard returned by the plan
+        process_entity_task = PythonOperator.partial(
             task_id=f'process_entity_{entity["Entity"]}',
             python_callable=process_entity,
-            op_kwargs={'entity': entity, 'blob_path': blob_path},
+        ).expand(op_kwargs=plan_entity_shards_task.output)
+
+        merge_entity_shards_task = PythonOperator(
+            task_id=f'merge_entity_shards_{entity_name}',
+            python_callable=merge_entity_shards,
+            op_kwargs={'entity': entity, 'blob_path': blob_path, 'plan_task_id': plan_entity_shards_task.task_id},
         )
 
         process_entity_tables_task = PythonOperator(
@@ -94,7 +128,18 @@ def create_dynamic_tasks():
             op_kwargs={'schema': schema, 'entity_name': entity_name},
         )
 
-        process_entity_task >> process_entity_tables_task
+        process_entity_task >> merge_entity_shards_task
+
+        if write_parquet:
+            land_entity_parquet_task = PythonOperator(
+                task_id=f'land_entity_parquet_{entity_name}',
+                python_callable=land_entity_parquet,
+                op_kwargs={'schema': schema, 'entity_name': entity_name},
+            )
+
+            merge_entity_shards_task >> land_entity_parquet_task >> process_entity_tables_task
+        else:
+            merge_entity_shards_task >> process_entity_tables_task
 
 
 
@@ -135,6 +180,10 @@ def fetch_and_write_latest_versions(**kwargs):
     """
     Fetches the latest versions of entities, writes them to Azure Storage, and logs the value of latest_versions.
 
+    The versions captured from the changes feeds by the `plan_entity_shards` tasks are used, so
+    changes made while the run was in progress are picked up by the next run. Only entities without
+    a captured version (e.g. on their first run) are looked up (see `update_latest_version`).
+
     Parameters:
     - kwargs: A dictionary of keyword arguments.
 
@@ -146,7 +195,17 @@ def fetch_and_write_latest_versions(**kwargs):
 
     entities = ti.xcom_pull(task_ids='get_entities', key='entities')
 
-    latest_versions = update_latest_version(entities) # this function is defined in plugins/api_utils.py. It fetches the latest versions of entities.
+    latest_versions = {}
+    missing_entities = []
+    for entity in entities:
+        captured_version = ti.xcom_pull(task_ids=f"{entities_group_id}.plan_entity_shards_{entity['Entity']}", key='latest_version')
+        if captured_version is not None:
+            latest_versions[entity['Entity']] = captured_version
+        else:
+            missing_entities.append(entity)
+
+    if missing_entities:
+        latest_versions.update(update_latest_version(missing_entities)) # this function is defined in plugins/api_utils.py. It fetches the latest versions of entities.
     latest_versions_json = json.dumps(latest_versions)
 
     # Write latest versions to Azure Storage
@@ -155,58 +214,416 @@ def fetch_and_write_latest_versions(**kwargs):
     # Log the value of latest_versions
     logging.info(f"Latest Versions: {latest_versions}")
 
-def process_entity(entity, **kwargs):
+def get_entity_outputs(entity, entity_arrays):
+    """
+    Returns the names of the blobs landed for an entity: the run file and one file per array.
+
+    Args:
+        entity (dict): A dictionary containing the entity endpoint and name.
+        entity_arrays (list): The contents of cosential_arrays.json.
+
+    Returns:
+        list: The blob names, before the landing format is applied (e.g. `run=temp.json`, `Office.json`).
+    """
+    outputs = [f"run={hour}.json"]
+    for entity_array in entity_arrays:
+        if entity_array['Entity'] == entity['Entity']:
+            outputs.extend(f'{array}.json' for array in entity_array['Arrays'])
+    return outputs
+
+
+def get_part_blob_name(blob_path, output_name, shard, chunk=0):
+    """
+    Returns the name of the part file a shard lands for one chunk of one of the entity outputs.
+
+    Args:
+        blob_path (str): The year=/month=/day= partition of the run.
+        output_name (str): The output blob name (see `get_entity_outputs`).
+        shard (int): The shard number.
+        chunk (int): The checkpointed chunk number within the shard.
+
+    Returns:
+        str: The part blob name relative to the entity folder, before the landing format is applied.
+    """
+    return os.path.join(blob_path, 'parts', output_name.split('.', 1)[0], f'part-{shard:05d}-{chunk:05d}.json')
+
+
+def get_checkpoint_blob_name(blob_path, shard):
+    """
+    Returns the name of the checkpoint of a shard, relative to the entity folder.
+
+    Args:
+        blob_path (str): The year=/month=/day= partition of the run.
+        shard (int): The shard number.
+
+    Returns:
+        str: The checkpoint blob name.
+    """
+    return os.path.join(blob_path, 'checkpoints', f'shard-{shard:05d}.json')
+
+
+def load_checkpoint(entity, blob_path, shard, run_id, shard_ids, chunk_size):
+    """
+    Loads the checkpoint of a shard, or starts a new one.
+
+    A checkpoint is only resumed when it was written by the same DAG run for the same IDs and
+    chunk size, so a retry skips the chunks that were already landed while a new run starts over.
+
+    Args:
+        entity (dict): A dictionary containing the entity endpoint and name.
+        blob_path (str): The year=/month=/day= partition of the run.
+        shard (int): The shard number.
+        run_id (str): The DAG run ID.
+        shard_ids (list): The changed IDs of the shard.
+        chunk_size (int): The number of IDs per chunk.
+
+    Returns:
+        dict: The checkpoint, with the landed chunks under `chunks`.
+    """
+    new_checkpoint = {
+        'run_id': run_id,
+        'ids': hashlib.sha1(json.dumps(shard_ids).encode('UTF-8')).hexdigest(),
+        'chunk_size': chunk_size,
+        'chunk_count': max(1, math.ceil(len(shard_ids) / chunk_size)),
+        'chunks': {},
+    }
+
+    checkpoint = read_from_azure_storage(blob_container, os.path.join(entity['Entity'], get_checkpoint_blob_name(blob_path, shard)))
+    if checkpoint and all(checkpoint.get(key) == new_checkpoint[key] for key in ('run_id', 'ids', 'chunk_size')):
+        logging.info(f"Resuming {entity['Entity']} shard {shard}: {len(checkpoint['chunks'])} of {checkpoint['chunk_count']} chunks already landed")
+        return checkpoint
+
+    return new_checkpoint
+
+
+def plan_entity_shards(entity, **kwargs):
+    """
+    Fetches the changes of an entity and splits the objects to upsert into extraction shards.
+
+    The change set is landed as `changes.json` and its deleted IDs as `deleted.json`. The number of
+    shards follows from the entity's `ShardSize` (or SHARD_SIZE) and is capped at MAX_SHARDS.
+
+    Args:
+        entity (dict): A dictionary containing the entity endpoint and name.
+        **kwargs: Additional keyword arguments, including the blob_path and the task instance.
+
+    Returns:
+        list: The op_kwargs of each `process_entity` shard.
+    """
     ti = kwargs['ti']
+    blob_path = kwargs['blob_path']
 
     versions = ti.xcom_pull(task_ids='get_versions', key='versions')
+
+    # Fetch the changes since the stored version, keeping the newest version for fetch_and_write_latest_versions
+    change_set = fetch_changed_ids(entity, versions)
+
+    # Land the change set: the objects to pull, and the deleted objects for process_entity_tables
+    for name, data in (('changes.json', change_set.to_dict()), ('deleted.json', change_set.deletes)):
+        if not write_data_azure_storage(json.dumps(data), blob_container, entity, os.path.join(blob_path, name)):
+            raise RuntimeError(f"Writing {name} of {entity['Entity']} failed")
+
+    # Only advance the stored version once the changes it covers are landed
+    ti.xcom_push(key='latest_version', value=change_set.latest_version)
+
+    entity_shard_size = int(entity.get('ShardSize') or shard_size)
+    changed_count = len(change_set.upserts)
+
+    # A bulk pull scans the whole list endpoint once, so it is not split across shards
+    strategy = choose_extraction_strategy(entity, changed_count)
+    if strategy == 'bulk':
+        shard_count = 1
+    else:
+        shard_count = max(1, min(max_shards, math.ceil(changed_count / entity_shard_size)))
+    logging.info(f"Splitting {changed_count} changed IDs for {entity['Entity']} into {shard_count} {strategy} shards")
+
+    return [
+        {'entity': entity, 'blob_path': blob_path, 'shard': shard, 'shard_count': shard_count, 'strategy': strategy}
+        for shard in range(shard_count)
+    ]
+
+
+def land_chunk(entity, chunk_ids, arrays, array_mappings, blob_path, shard, chunk, failures, strategy=None):
+    """
+    Pulls the objects and arrays of one chunk of changed IDs and lands them as part files.
+
+    Every part file is a stage of a pipeline: its records are fetched in the background and
+    handed over through a bounded queue of PIPELINE_QUEUE_SIZE records, while they are serialized
+    and uploaded. The part files of a chunk are landed concurrently. Mapped arrays (see
+    `get_array_mappings`) read the object stream as it is fetched (see `iter_fanout`), and are
+    only requested from their endpoint for the objects that do not embed them.
+
+    Args:
+        entity (dict): A dictionary containing the entity endpoint and name.
+        chunk_ids (dict): The IDs of the chunk, by entity name.
+        arrays (list): The names of the entity's arrays.
+        array_mappings (dict): The compiled mappings of the entity's mapped arrays.
+        blob_path (str): The path of the run's blobs.
+        shard (int): The shard number.
+        chunk (int): The chunk number.
+        failures (list): A list to which (object_id, error message) tuples are appended.
+        strategy (str, optional): How objects are pulled (see `choose_extraction_strategy`).
+
+    Returns:
+        tuple: The results of the uploads (see `write_data_azure_storage`) and the number of objects landed.
+    """
+    mapped_arrays = [array for array in arrays if array in array_mappings]
+    object_streams = iter_fanout(iter_entity_objects(entity, chunk_ids, failures, strategy), 1 + len(mapped_arrays))
+    object_count = 0
+
+    def iter_objects(stream):
+        nonlocal object_count
+        for _, record in stream:
+            object_count += 1
+            yield record
+
+    def iter_mapped_array(array, stream):
+        # Take the array from the parent payloads, and only request it for parents that do not embed it
+        missing_ids = []
+        yield from iter_flattened(stream, array_mappings[array], missing_ids)
+        if missing_ids:
+            yield from iter_entity_arrays(entity, array, {entity['Entity']: missing_ids}, failures)
+
+    # Each output is a part file name, its records and the stream they are read from
+    outputs = [(f"run={hour}.json", iter_objects(object_streams[0]), object_streams[0])]
+    outputs.extend(
+        (f'{array}.json', iter_mapped_array(array, stream), stream) for array, stream in zip(mapped_arrays, object_streams[1:])
+    )
+    for array in arrays:
+        if array not in array_mappings:
+            stream = iter_prefetched(iter_entity_arrays(entity, array, chunk_ids, failures))
+            outputs.append((f'{array}.json', stream, stream))
+
+    def land(output_name, records, stream):
+        try:
+            return write_data_azure_storage(records, blob_container, entity, get_part_blob_name(blob_path, output_name, shard, chunk), landing_format)
+        finally:
+            # A failed upload stops the fetch, so the uploads sharing its object stream fail too instead of waiting
+            stream.close()
+
+    # The uploads sharing the object stream must all run at once, or the first one would wait on the others
+    with ThreadPoolExecutor(max_workers=len(outputs), thread_name_prefix='land') as executor:
+        landed_blobs = list(executor.map(lambda output: land(*output), outputs))
+
+    return landed_blobs, object_count
+
+
+def process_entity(entity, shard=0, shard_count=1, strategy=None, **kwargs):
+    """
+    Pulls the objects and arrays of one shard of an entity's changed IDs and lands them as part files.
+
+    The shard is landed in chunks of CHECKPOINT_SIZE IDs (or the entity's `CheckpointSize`), and the
+    shard's checkpoint is updated after every chunk. A retry of the task resumes from the checkpoint
+    and only pulls the chunks that were not landed yet (see `load_checkpoint`).
+
+    Args:
+        entity (dict): A dictionary containing the entity endpoint and name.
+        shard (int): The shard number.
+        shard_count (int): The number of shards.
+        strategy (str, optional): How objects are pulled (see `choose_extraction_strategy`).
+        **kwargs: Additional keyword arguments, including the blob_path and the task instance.
+
+    Returns:
+        dict: A handle to the landed shard.
+    """
+    ti = kwargs['ti']
+
     entity_arrays = ti.xcom_pull(task_ids='get_arrays', key='entity_arrays')
 
     blob_path = kwargs['blob_path']
 
-    # Fetch changed IDs based on versions
-    changed_ids = fetch_changed_ids(entity, versions)
-    # Pull entity objects using changed IDs
-    entity_results = pull_entity_objects(entity, changed_ids)
+    # Take this shard's contiguous slice of the objects to upsert (see `ChangeSet`)
+    change_set = read_from_azure_storage(blob_container, os.path.join(entity['Entity'], blob_path, 'changes.json'))
+    if not change_set:
+        raise RuntimeError(f"The change set of {entity['Entity']} could not be read")
+    ids = change_set['upserts']
+    shard_ids = ids[shard * len(ids) // shard_count:(shard + 1) * len(ids) // shard_count]
 
-    for entity_array in entity_arrays:
-        if entity_array['Entity'] == entity['Entity']:
-            for array in entity_array['Arrays']:
-                entity_array_values = pull_entity_arrays(entity, array, changed_ids)
-                entity_array_json = json.dumps(entity_array_values, ensure_ascii=False, indent=4)
-                write_data_azure_storage(entity_array_json, blob_container, entity, os.path.join(blob_path, f'{array}.json'))
+    # A bulk pull scans the list endpoint once per chunk, so it lands the shard as a single chunk
+    if strategy == 'bulk':
+        chunk_size = max(1, len(shard_ids))
+    else:
+        chunk_size = int(entity.get('CheckpointSize') or checkpoint_size)
 
-    # Serialize and store the processed data
-    processed_data_json = json.dumps(entity_results, ensure_ascii=False, indent=4)
-    write_data_azure_storage(processed_data_json, blob_container, entity, os.path.join(blob_path, f"run={hour}.json"))
+    checkpoint = load_checkpoint(entity, blob_path, shard, kwargs['run_id'], shard_ids, chunk_size)
+    checkpoint_name = get_checkpoint_blob_name(blob_path, shard)
+    arrays = [array for entity_array in entity_arrays if entity_array['Entity'] == entity['Entity'] for array in entity_array['Arrays']]
+    array_mappings = get_array_mappings(entity_arrays, entity['Entity'])
 
-    return entity_results
+    for chunk in range(checkpoint['chunk_count']):
+        if str(chunk) in checkpoint['chunks']:
+            continue
 
-def process_entity_tables(schema, entity_name):
+        chunk_ids = {entity['Entity']: shard_ids[chunk * chunk_size:(chunk + 1) * chunk_size]}
+        failures = []
+
+        # Pull entity objects and arrays using changed IDs, and land them as this chunk's part files
+        landed_blobs, object_count = land_chunk(entity, chunk_ids, arrays, array_mappings, blob_path, shard, chunk, failures, strategy)
+
+        if not all(landed_blobs):
+            raise RuntimeError(f"Landing chunk {chunk} of {entity['Entity']} shard {shard} failed")
+
+        # Record the chunk only once all of its part files are landed
+        checkpoint['chunks'][str(chunk)] = {'objects': object_count, 'failed_ids': sorted({object_id for object_id, _ in failures})}
+        if not write_data_azure_storage(json.dumps(checkpoint), blob_container, entity, checkpoint_name):
+            raise RuntimeError(f"Writing the checkpoint of {entity['Entity']} shard {shard} failed")
+
+    # Report the IDs that could not be pulled so they can be inspected or re-requested
+    failed_ids = sorted({object_id for landed_chunk in checkpoint['chunks'].values() for object_id in landed_chunk['failed_ids']})
+    if failed_ids:
+        logging.warning(f"{len(failed_ids)} objects failed for {entity['Entity']} shard {shard}")
+        ti.xcom_push(key='failed_ids', value=failed_ids)
+
+    # Return a handle to the landed data rather than the data itself, which would be stored in XCom
+    objects = sum(landed_chunk['objects'] for landed_chunk in checkpoint['chunks'].values())
+    return {'Entity': entity['Entity'], 'shard': shard, 'objects': objects, 'chunks': checkpoint['chunk_count']}
+
+
+def merge_entity_shards(entity, plan_task_id, **kwargs):
+    """
+    Assembles the run file of every entity output from the part files landed by the shards.
+
+    The part files of each shard are taken from its checkpoint, in chunk order, so the run is
+    assembled from the parts landed across all attempts. The run file (e.g. `run=temp.ndjson.gz`)
+    is concatenated from the parts on the storage service (see `assemble_blob`), so no data passes
+    through the worker. A manifest listing the parts is written next to it, and is followed by
+    `iter_landed_records`. The IDs of the objects that were reloaded,
+    i.e. pulled without failures, are landed as `reloaded.json` for `process_entity_tables`.
+
+    Args:
+        entity (dict): A dictionary containing the entity endpoint and name.
+        plan_task_id (str): The task ID of the entity's `plan_entity_shards` task.
+        **kwargs: Additional keyword arguments, including the blob_path and the task instance.
+
+    Returns:
+        None
+    """
+    ti = kwargs['ti']
+    blob_path = kwargs['blob_path']
+
+    entity_arrays = ti.xcom_pull(task_ids='get_arrays', key='entity_arrays')
+    shard_count = len(ti.xcom_pull(task_ids=plan_task_id))
+
+    chunk_counts = []
+    failed_ids = set()
+    for shard in range(shard_count):
+        checkpoint = read_from_azure_storage(blob_container, os.path.join(entity['Entity'], get_checkpoint_blob_name(blob_path, shard)))
+        if not checkpoint or len(checkpoint['chunks']) != checkpoint['chunk_count']:
+            raise RuntimeError(f"Shard {shard} of {entity['Entity']} has not landed all of its chunks")
+        chunk_counts.append(checkpoint['chunk_count'])
+        failed_ids.update(object_id for landed_chunk in checkpoint['chunks'].values() for object_id in landed_chunk['failed_ids'])
+
+    change_set = read_from_azure_storage(blob_container, os.path.join(entity['Entity'], blob_path, 'changes.json'))
+    if not change_set:
+        raise RuntimeError(f"The change set of {entity['Entity']} could not be read")
+    reloaded_ids = [object_id for object_id in change_set['upserts'] if object_id not in failed_ids]
+    if not write_data_azure_storage(json.dumps(reloaded_ids), blob_container, entity, os.path.join(blob_path, 'reloaded.json')):
+        raise RuntimeError(f"Writing the reloaded IDs of {entity['Entity']} failed")
+
+    for output_name in get_entity_outputs(entity, entity_arrays):
+        parts = [
+            os.path.join(entity['Entity'], landing_blob_name(get_part_blob_name(blob_path, output_name, shard, chunk)))
+            for shard in range(shard_count)
+            for chunk in range(chunk_counts[shard])
+        ]
+        assemble_blob(blob_container, os.path.join(entity['Entity'], blob_path, landing_blob_name(output_name)), parts)
+        manifest_name = manifest_blob_name(os.path.join(blob_path, landing_blob_name(output_name)))
+        if not write_data_azure_storage(json.dumps({'parts': parts}), blob_container, entity, manifest_name):
+            raise RuntimeError(f"Writing the manifest of {entity['Entity']} {output_name} failed")
+
+
+def get_table_blob_names(entity_name, table_dict):
+    """
+    Returns the landed blob and the Parquet blob for a schema table.
+
+    Args:
+        entity_name (str): The name of the entity.
+        table_dict (dict): The table definition from Cosential_Table_Schemas.json.
+
+    Returns:
+        tuple: (blob_name, parquet_blob_name) under the year=/month=/day= partition of the run.
+    """
+    partition = os.path.join(entity_name, f"year={year}", f"month={month}", f"day={day}")
+    file_name = table_dict['file_name']
+
+    if file_name == 'default':
+        blob_name = os.path.join(partition, landing_blob_name(f"run={hour}.json"))
+    else:
+        blob_name = os.path.join(partition, landing_blob_name(file_name))
+
+    return blob_name, os.path.join(partition, f"{table_dict['table_name']}.parquet")
+
+
+def land_entity_parquet(schema, entity_name):
+    """
+    Writes a typed Parquet file for every schema table of an entity.
+
+    Each table's columns are projected from its landed blob and stored next to it as
+    `{table_name}.parquet`, so later readers only scan the columns they need.
+
+    Args:
+        schema (dict): The contents of Cosential_Table_Schemas.json.
+        entity_name (str): The name of the entity.
 
-    for entity_dict in schema['Entities']:
-        if entity_dict['Entity'] == entity_name:
-            for table_dict in entity_dict['tables']:
-                table_name = table_dict['table_name']
-                file_name = table_dict['file_name']
-                columns = table_dict['columns']
+    Returns:
+        None
+    """
+    for table_plan in get_table_plans(schema, entity_name):
+        blob_name, parquet_blob_name = get_table_blob_names(entity_name, table_plan.table_dict)
+        print(blob_name)
+
+        records = iter_prefetched(iter_landed_records(blob_container, blob_name))
+        write_parquet_azure_storage(table_plan.iter_rows(records), blob_container, parquet_blob_name, table_plan.columns)
+
+
+def load_table(transformed_data, table_plan, deleted_ids, reloaded_ids=None):
+    """
+    Loads rows into the SQL table of a schema table.
+
+    Tables that declare a `merge_key` in Cosential_Table_Schemas.json are upserted on it
+    (with an optional `parent_key` for array tables, whose rows of reloaded parents are
+    replaced) and have the rows of deleted objects removed; all other tables are appended to.
+
+    Args:
+        transformed_data (iterable): The rows (tuples in column order) to load.
+        table_plan (TablePlan): The compiled table definition (see `get_table_plans`).
+        deleted_ids (list): The IDs of objects deleted in Cosential.
+        reloaded_ids (list, optional): The IDs of the objects reloaded in this run.
+
+    Returns:
+        None
+    """
+    if table_plan.merge_key:
+        merge_data_azure_sql(transformed_data, table_plan.table_name, table_plan.columns, table_plan.merge_key, table_plan.parent_key, deleted_ids,
+                             reloaded_ids=reloaded_ids)
+    else:
+        write_data_azure_sql(transformed_data, table_plan.table_name, table_plan.columns)
+
+
+def process_entity_tables(schema, entity_name):
 
-                if file_name == 'default':
-                    blob_name = os.path.join(entity_name, f"year={year}", f"month={month}", f"day={day}", f"run={hour}.json")
-                    print(blob_name)
-                else:
-                    blob_name = os.path.join(entity_name, f"year={year}", f"month={month}", f"day={day}", file_name)
-                    print(blob_name)
+    # A change set that cannot be read must fail the load, not skip the deletes
+    partition = os.path.join(entity_name, f"year={year}", f"month={month}", f"day={day}")
+    deleted_ids = read_from_azure_storage(blob_container, os.path.join(partition, 'deleted.json'))
+    reloaded_ids = read_from_azure_storage(blob_container, os.path.join(partition, 'reloaded.json'))
+    if deleted_ids is False or reloaded_ids is False:
+        raise RuntimeError(f"The deleted or reloaded IDs of {entity_name} could not be read")
 
-                opp = read_from_azure_storage(blob_container, blob_name)
+    # The entity's tables, compiled once per schema (see `get_table_plans`)
+    for table_plan in get_table_plans(schema, entity_name):
+        blob_name, parquet_blob_name = get_table_blob_names(entity_name, table_plan.table_dict)
 
-                if not opp:
-                    raise ValueError(f"Failed to read data from Azure storage for blob {blob_name}")
+        # Load from the typed Parquet copy when it is written, reading only the table's columns
+        if write_parquet:
+            print(parquet_blob_name)
+            load_table(iter_rows_parquet_azure_storage(blob_container, parquet_blob_name, table_plan.columns), table_plan, deleted_ids, reloaded_ids)
+            continue
 
-                transformed_data = [
-                    tuple(item.get(column['name']) for column in columns) for item in opp
-                ]
+        print(blob_name)
 
-                write_data_azure_sql(transformed_data, table_name, columns)
+        # Download and parse the blob in the background while earlier batches are inserted
+        records = iter_prefetched(iter_landed_records(blob_container, blob_name))
+        load_table(table_plan.iter_rows(records), table_plan, deleted_ids, reloaded_ids)
 
 default_args = {
     'owner': 'airflow',
@@ -214,8 +631,12 @@ default_args = {
     'start_date': datetime(2023, 1, 1),
     'email_on_failure': False,
     'email_on_retry': False,
-    'retries': 0,
+    'retries': 2,
     'retry_delay': timedelta(minutes=5),
+    # Log a summary of the API, blob and SQL metrics of every task
+    'on_execute_callback': metrics.reset,
+    'on_success_callback': metrics.log_summary,
+    'on_failure_callback': metrics.log_summary,
 }
 
 # Define your DAG
@@ -283,7 +704,7 @@ with DAG(
 
 
 
-    with TaskGroup(group_id='process_entities') as process_entities_group:
+    with TaskGroup(group_id=entities_group_id) as process_entities_group:
         create_dynamic_tasks()
 
 
@@ -1,126 +1,619 @@
+import itertools
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from plugins.azure_utils import get_secret
-import os
+from plugins import metrics
+
+logger = logging.getLogger(__name__)
 
-# Pull the environment variables
+# Pull the environment variables. The secret values are read from Key Vault when the
+# session is first created (see get_session), so importing this module makes no network call.
 cos_username = os.getenv('COSENTIAL_USER')
 firm_id = os.getenv('COSENTIAL_FIRM_ID')
 cosential_pw_secret_name = os.getenv('COSENTIAL_PW_SECRET')
 cosential_api_key_secret_name = os.getenv('COSENTIAL_APIKEY_SECRET')
 
-# Get the secret values
-cosential_pw = get_secret(cosential_pw_secret_name)
-cosential_api_key = get_secret(cosential_api_key_secret_name)
+# Bounded concurrency for per-object requests (overridable per entity with MaxConcurrency)
+default_max_workers = int(os.getenv('COSENTIAL_MAX_WORKERS', '8'))
+max_reported_failures = 20
+
+# HTTP connection pool and retry settings
+base_url = os.getenv('COSENTIAL_BASE_URL', "https://compass.cosential.com/")
+pool_size = int(os.getenv('COSENTIAL_POOL_SIZE', str(default_max_workers)))
+request_timeout = float(os.getenv('COSENTIAL_TIMEOUT', '60'))
+max_retries = int(os.getenv('COSENTIAL_MAX_RETRIES', '5'))
+backoff_base = float(os.getenv('COSENTIAL_BACKOFF_BASE', '0.5'))
+backoff_max = float(os.getenv('COSENTIAL_BACKOFF_MAX', '60'))
+retry_status_codes = {429, 500, 502, 503, 504}
+page_size = 500
+
+# Paged pulls keep up to this many pages in flight, and adjust SIZE between the bounds toward
+# the highest observed throughput. Raise the maximum only up to the largest SIZE the API honours.
+page_prefetch = int(os.getenv('COSENTIAL_PAGE_PREFETCH', '4'))
+page_size_min = int(os.getenv('COSENTIAL_PAGE_SIZE_MIN', '100'))
+page_size_max = int(os.getenv('COSENTIAL_PAGE_SIZE_MAX', str(page_size)))
+_page_sizers = {}
+_page_sizers_lock = threading.Lock()
+
+# Default share of an entity's objects that must have changed before a paged list pull
+# replaces per-ID requests (overridable per entity with BulkChangeRatio)
+default_bulk_change_ratio = float(os.getenv('COSENTIAL_BULK_CHANGE_RATIO', '0.2'))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Returns the module-level HTTP session for the Cosential API.
+
+    The session (and the Cosential secrets it needs) is created on first use and shared
+    by all threads of the process, so TCP/TLS connections to the API are kept alive and reused across calls. At most
+    COSENTIAL_POOL_SIZE connections are opened; further requests wait for a free one.
+
+    Returns:
+        requests.Session: The shared session with authentication and headers set.
+    """
+    global _session
 
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
 
+                session.auth = HTTPBasicAuth(cos_username, get_secret(cosential_pw_secret_name))
+                session.headers.update({
+                    'x-compass-firm-id': firm_id,
+                    'x-compass-api-key': get_secret(cosential_api_key_secret_name),
+                    'Content-Type': 'application/json'
+                })
+                _session = session
 
-def make_api_call(relative_url):
+    return _session
+
+
+def get_retry_delay(attempt, response=None):
     """
-    Helper function to make an API call.
+    Returns the number of seconds to wait before retrying a request.
+
+    A `Retry-After` header (in seconds or as an HTTP date) is honored when present.
+    Otherwise the delay is drawn from exponential backoff with full jitter.
+
+    Args:
+        attempt (int): The zero-based number of the attempt that failed.
+        response (requests.Response, optional): The response of the failed attempt.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+
+    if retry_after:
+        try:
+            return min(backoff_max, max(0.0, float(retry_after)))
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(retry_after)
+                return min(backoff_max, max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds()))
+            except (TypeError, ValueError):
+                pass
+
+    return random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt))
+
+
+def request_with_retry(url, params=None):
+    """
+    Sends a GET request on the shared session, retrying transient failures.
+
+    Connection errors, timeouts and responses with a status in `retry_status_codes`
+    are retried up to COSENTIAL_MAX_RETRIES times (see `get_retry_delay`).
+
+    Args:
+        url (str): The absolute URL to request.
+        params (dict, optional): The query parameters.
+
+    Returns:
+        requests.Response: The successful response.
+
+    Raises:
+        requests.exceptions.RequestException: If the request still fails after all retries.
+    """
+    session = get_session()
+
+    for attempt in range(max_retries + 1):
+        started = time.monotonic()
+        try:
+            response = session.get(url, params=params, timeout=request_timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            metrics.incr('api.connection_errors')
+            if attempt == max_retries:
+                raise
+            delay = get_retry_delay(attempt)
+            logger.info(f"Retrying {url} in {delay:.1f}s after error: {e}")
+        else:
+            metrics.timing('api.latency', (time.monotonic() - started) * 1000)
+            metrics.incr('api.requests')
+            metrics.incr(f'api.status.{response.status_code}')
+            metrics.incr('api.bytes', len(response.content))
+
+            if response.status_code not in retry_status_codes or attempt == max_retries:
+                response.raise_for_status()
+                return response
+            delay = get_retry_delay(attempt, response)
+            logger.info(f"Retrying {url} in {delay:.1f}s after status {response.status_code}")
+            response.close()
+
+        metrics.incr('api.retries')
+        metrics.timing('api.retry_delay', delay * 1000)
+        time.sleep(delay)
+
+
+class PageSizer:
+    """
+    Adjusts the page size of an endpoint toward the highest observed throughput.
+
+    Every page reports its response size and duration. The sizer steps the size in one
+    direction while the smoothed bytes/sec improve. When a step makes throughput worse, or
+    a bound is reached, it holds the best size found. While holding, it probes a neighbouring
+    size once every `probe_interval` pages, or as soon as throughput falls by more than
+    `tolerance`. Sizes are rounded to multiples of `granularity`, so the same few sizes recur.
+    """
+
+    step = 1.5
+    granularity = 50
+    probe_interval = 20
+    tolerance = 0.2
+
+    def __init__(self, size, minimum, maximum):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.size = self.clamp(size)
+        self.direction = 1
+        self.previous_size = None
+        self.previous_rate = None
+        self.holding = False
+        self.held_pages = 0
+        self.hold_rate = None
+        self.rates = {}
+        self.lock = threading.Lock()
+
+    def clamp(self, size):
+        if size >= self.granularity:
+            size = round(size / self.granularity) * self.granularity
+        return max(self.minimum, min(self.maximum, int(size)))
+
+    def hold(self, rate):
+        self.holding = True
+        self.held_pages = 0
+        self.hold_rate = rate
+
+    def move(self, rate):
+        """Steps away from the current size, turning around at a bound. Holds if there is nowhere to go."""
+        next_size = self.clamp(self.size * self.step ** self.direction)
+        if next_size == self.size:
+            self.direction = -self.direction
+            next_size = self.clamp(self.size * self.step ** self.direction)
+        if next_size == self.size:
+            self.hold(rate)
+            return
+        self.holding = False
+        self.previous_size, self.previous_rate = self.size, rate
+        self.size = next_size
+
+    def observe(self, size, byte_count, elapsed):
+        """
+        Records the throughput of a page and picks the size of the next pages.
+
+        Args:
+            size (int): The SIZE the page was requested with.
+            byte_count (int): The size of the response body in bytes.
+            elapsed (float): The duration of the request in seconds.
+        """
+        rate = byte_count / max(elapsed, 1e-6)
+
+        with self.lock:
+            # Smooth the rate of each size, and only act on pages of the current size
+            self.rates[size] = 0.5 * self.rates[size] + 0.5 * rate if size in self.rates else rate
+            if size != self.size:
+                return
+            rate = self.rates[size]
+
+            if self.holding:
+                self.held_pages += 1
+                if self.held_pages < self.probe_interval and rate >= self.hold_rate * (1 - self.tolerance):
+                    return
+                self.move(rate)
+                return
+
+            if self.previous_rate is not None and rate < self.previous_rate:
+                # The step made things worse, so go back to the better size and hold it
+                self.size = self.previous_size
+                self.direction = -self.direction
+                self.hold(self.rates.get(self.size, self.previous_rate))
+                return
+
+            next_size = self.clamp(self.size * self.step ** self.direction)
+            if next_size == self.size:
+                # At a bound, stay while throughput holds up
+                self.hold(rate)
+                return
+            self.previous_size, self.previous_rate = self.size, rate
+            self.size = next_size
+
+
+def get_page_sizer(relative_url):
+    """
+    Returns the page sizer shared by all calls to an endpoint, so learned sizes carry over.
+
+    Object IDs in the URL are ignored, so e.g. all {endpoint}/{id}/{array} calls share a sizer.
 
     Args:
         relative_url (str): The relative URL for the API endpoint.
 
     Returns:
-        list: The list of JSON responses from the API call.
+        PageSizer: The page sizer of the endpoint.
     """
-    base_url = "https://compass.cosential.com/"
+    key = re.sub(r'/\d+(?=/|$)', '/{id}', relative_url.split('?')[0])
 
-    api_endpoint = base_url + relative_url
+    with _page_sizers_lock:
+        if key not in _page_sizers:
+            _page_sizers[key] = PageSizer(page_size, page_size_min, page_size_max)
+        return _page_sizers[key]
 
-    headers = {
-        'x-compass-firm-id': firm_id,
-        'x-compass-api-key': cosential_api_key,
-        'Content-Type': 'application/json'
-    }
 
-    try:
-        aggregated_data = []  # List to hold all response data
+def iter_pages(relative_url, size=None, prefetch=None):
+    """
+    Yields the pages of an API endpoint as they arrive.
+
+    The first page is requested on its own. If it is full, up to `prefetch` further pages are
+    kept in flight, each one at the FROM offset following the previous request, and pages are
+    yielded in order. Paging stops at the first page holding fewer records than requested, and
+    the speculative requests past it are discarded. Each response body is parsed exactly once.
+
+    Without an explicit `size`, SIZE is adjusted between COSENTIAL_PAGE_SIZE_MIN and
+    COSENTIAL_PAGE_SIZE_MAX toward the fastest bytes/sec (see `PageSizer`).
+
+    Args:
+        relative_url (str): The relative URL for the API endpoint.
+        size (int, optional): A fixed number of records requested per page.
+        prefetch (int, optional): The number of pages kept in flight (defaults to COSENTIAL_PAGE_PREFETCH).
 
-        # Initialize paging parameters
-        size = 500
-        from_value = 0
-        total_records = 0
+    Yields:
+        list | dict: The parsed page. Object endpoints (e.g. {endpoint}/{id}) yield a
+        single JSON object and stop.
 
+    Raises:
+        requests.exceptions.RequestException: If a request fails.
+    """
+    api_endpoint = base_url + relative_url
+    prefetch = max(1, prefetch or page_prefetch)
+    sizer = None if size else get_page_sizer(relative_url)
+
+    def fetch_page(from_value, requested_size):
+        # Set paging parameters in the API call
+        params = {
+            'SIZE': requested_size,
+            'FROM': from_value
+        }
+
+        started = time.monotonic()
+        response = request_with_retry(api_endpoint, params)
+        page = response.json()
+        metrics.incr('api.pages')
+        if sizer is not None:
+            sizer.observe(requested_size, len(response.content), time.monotonic() - started)
+        return page, requested_size
+
+    def is_last(page, requested_size):
+        # Object endpoints return a single JSON object, and a short page is the last one
+        return not isinstance(page, list) or len(page) < requested_size
+
+    page, requested_size = fetch_page(0, size or sizer.size)
+    yield page
+    if is_last(page, requested_size):
+        return
+    from_value = requested_size
+
+    executor = ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix='cosential-pages')
+    in_flight = deque()
+    try:
         while True:
-            # Set paging parameters in the API call
-            params = {
-                'SIZE': size,
-                'FROM': from_value
-            }
-
-            response = requests.get(
-                api_endpoint,
-                auth=HTTPBasicAuth(cos_username, cosential_pw),
-                headers=headers,
-                params=params
-            )
-            response.raise_for_status()
-
-            # Append response data to aggregated_data
-            aggregated_data.extend(response.json())
-
-            # Update total records and check if there are more pages
-            total_records += len(response.json())
-            if len(response.json()) < size:
-                break
+            while len(in_flight) < prefetch:
+                next_size = size or sizer.size
+                in_flight.append(executor.submit(fetch_page, from_value, next_size))
+                from_value += next_size
+
+            page, requested_size = in_flight.popleft().result()
+            yield page
+            if is_last(page, requested_size):
+                return
+    finally:
+        for future in in_flight:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def iter_records(relative_url):
+    """
+    Yields the records of an API endpoint one at a time, page by page.
 
-            # Increment from_value for the next page
-            from_value += size
+    Args:
+        relative_url (str): The relative URL for the API endpoint.
+
+    Yields:
+        dict: A record from the response.
+
+    Raises:
+        requests.exceptions.RequestException: If a request fails.
+    """
+    for page in iter_pages(relative_url):
+        if isinstance(page, list):
+            yield from page
+        else:
+            yield page
+
+
+def fetch_api_data(relative_url):
+    """
+    Fetches all pages for an API endpoint.
+
+    Unlike `make_api_call`, errors are raised to the caller so that they can be
+    collected per request.
+
+    Args:
+        relative_url (str): The relative URL for the API endpoint.
+
+    Returns:
+        list | dict: The aggregated list of records for collection endpoints, or the
+        single JSON object for object endpoints.
+
+    Raises:
+        requests.exceptions.RequestException: If a request fails.
+    """
+    aggregated_data = []  # List to hold all response data
+
+    for page in iter_pages(relative_url):
+        if not isinstance(page, list):
+            return page
+        aggregated_data.extend(page)
+
+    return aggregated_data
 
-        return aggregated_data
+
+def make_api_call(relative_url):
+    """
+    Helper function to make an API call.
+
+    Args:
+        relative_url (str): The relative URL for the API endpoint.
+
+    Returns:
+        list: The list of JSON responses from the API call, or None if the call failed.
+    """
+    try:
+        return fetch_api_data(relative_url)
 
     except Exception as e:
-        print(f"An error occurred while making the API call to {api_endpoint}: {str(e)}")
+        print(f"An error occurred while making the API call to {relative_url}: {str(e)}")
         return None
 
 
+def get_max_workers(entity_endpoint):
+    """
+    Returns the maximum number of in-flight requests for an entity.
+
+    The limit can be set per entity with the `MaxConcurrency` key in cosential_entities.json
+    and otherwise falls back to the COSENTIAL_MAX_WORKERS environment variable.
+
+    Args:
+        entity_endpoint (dict): A dictionary containing the entity endpoint and name.
+
+    Returns:
+        int: The maximum number of concurrent requests.
+    """
+    return max(1, int(entity_endpoint.get("MaxConcurrency") or default_max_workers))
+
+
+def fetch_concurrently(object_ids, fetch_object, max_workers=None, failures=None):
+    """
+    Fetches one result per object ID with a bounded number of requests in flight.
+
+    Results are yielded in the order of `object_ids`, regardless of the order in which
+    the requests complete. At most `max_workers` requests run at once and at most twice
+    that many results are held while waiting on a slower request.
+
+    Args:
+        object_ids (iterable): The object IDs to fetch.
+        fetch_object (callable): Called with a single object ID; returns its data or raises.
+        max_workers (int, optional): The maximum number of concurrent requests.
+        failures (list, optional): A list to which (object_id, error message) tuples are
+            appended for every request that failed.
+
+    Yields:
+        tuple: (object_id, data) for every request that succeeded.
+    """
+    max_workers = max_workers or default_max_workers
+    window = max_workers * 2
+    object_ids = iter(object_ids)
+    in_flight = deque()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for object_id in itertools.islice(object_ids, window):
+                in_flight.append((object_id, executor.submit(fetch_object, object_id)))
+
+            while in_flight:
+                object_id, future = in_flight.popleft()
+
+                # Keep the window full before blocking on the oldest request
+                for next_id in itertools.islice(object_ids, 1):
+                    in_flight.append((next_id, executor.submit(fetch_object, next_id)))
+
+                try:
+                    yield object_id, future.result()
+                except Exception as e:
+                    if failures is not None:
+                        failures.append((object_id, str(e)))
+        finally:
+            for _, future in in_flight:
+                future.cancel()
+
+
+def report_failures(entity, failures, total):
+    """
+    Logs a summary of the failed requests for an entity.
+
+    Args:
+        entity (str): The name of the entity.
+        failures (list): A list of (object_id, error message) tuples.
+        total (int): The number of requests that were made.
+
+    Returns:
+        None
+    """
+    if not failures:
+        return
+
+    logger.warning(f"{len(failures)} of {total} requests failed for {entity}")
+    for object_id, error in failures[:max_reported_failures]:
+        logger.warning(f"  {entity} ID {object_id}: {error}")
+    if len(failures) > max_reported_failures:
+        logger.warning(f"  ... and {len(failures) - max_reported_failures} more")
+
+
+class ChangeSet:
+    """
+    The changes of one entity since a version, with one entry per object ID.
+
+    Every object keeps only its latest change, so duplicates in the changes feed collapse into
+    one entry and objects whose latest change is a delete are split from those to upsert. The
+    set serializes to sorted integer arrays (see `to_dict`).
+    """
+
+    def __init__(self, entity, base_version=None):
+        self.entity = entity
+        self.base_version = base_version
+        self.change_count = 0
+        self._changes = {}  # object ID -> (version, is_deleted) of its latest change
+
+    def add(self, object_id, version=None, is_deleted=False):
+        """
+        Adds a change. An earlier change of the same object is replaced only by a newer version,
+        so with the newest-first feed (reverse=true) the first change seen per object wins.
+
+        Args:
+            object_id (int): The object ID.
+            version (int, optional): The version of the change.
+            is_deleted (bool): Whether the change deletes the object.
+        """
+        self.change_count += 1
+        current = self._changes.get(object_id)
+        if current is None or (version is not None and (current[0] is None or version > current[0])):
+            self._changes[object_id] = (version, bool(is_deleted))
+
+    def __len__(self):
+        return len(self._changes)
+
+    @property
+    def upserts(self):
+        """list: The sorted IDs of the objects to pull."""
+        return sorted(object_id for object_id, (_, is_deleted) in self._changes.items() if not is_deleted)
+
+    @property
+    def deletes(self):
+        """list: The sorted IDs of the deleted objects."""
+        return sorted(object_id for object_id, (_, is_deleted) in self._changes.items() if is_deleted)
+
+    @property
+    def latest_version(self):
+        """int: The newest version in the set, or the base version when nothing changed."""
+        versions = [version for version, _ in self._changes.values() if version is not None]
+        return max(versions + ([self.base_version] if self.base_version is not None else []), default=None)
+
+    def to_dict(self):
+        """
+        Returns the serializable form of the set.
+
+        Returns:
+            dict: The entity, the base and latest versions, and the sorted `upserts` and `deletes` IDs.
+        """
+        return {
+            'entity': self.entity,
+            'base_version': self.base_version,
+            'latest_version': self.latest_version,
+            'upserts': self.upserts,
+            'deletes': self.deletes,
+        }
+
 
 def fetch_changed_ids(entity_endpoint, versions):
     """
-    Fetches the changed IDs for the given entity endpoint.
+    Fetches the changes of the given entity endpoint since its latest version.
 
     Args:
         entity_endpoint (dict): A dictionary containing the entity endpoint and name.
-        cosential_pw (str): The password secret for authentication.
-        cosential_api_key (str): The API key secret for authentication.
         versions (dict): A dictionary containing the latest versions for each entity.
 
     Returns:
-        dict: A dictionary containing the changed IDs for the entity.
-    """
-
-    changed_ids = {}  # Create an empty dictionary to store the changed ids
+        ChangeSet: The changes of the entity. It is empty when the entity has no latest version.
 
+    Raises:
+        requests.exceptions.RequestException: If the changes feed cannot be read. A partial
+            feed would report a latest version past the changes that were missed.
+    """
     endpoint = entity_endpoint["Endpoint"]
     entity = entity_endpoint["Entity"]
     latest_version = versions.get(entity)  # Get the latest version for the entity
 
+    change_set = ChangeSet(entity, latest_version)
+
     if latest_version is not None:
         relative_url = f"{endpoint}/changes?version={latest_version}&includeDeleted=true&reverse=true"
 
         try:
-            changed_data = make_api_call(relative_url)   # Get the changed data from the response
-
-            # Extract the Id values from the changed data
-            changed_ids[entity] = [item["Id"] for item in changed_data]
-            print(f"Changed Ids for {entity}: {changed_ids[entity]}")
+            # Fold the changes into the change set as each page arrives
+            for item in iter_records(relative_url):
+                change_set.add(item["Id"], item.get("Version"), item.get("IsDeleted"))
 
         except Exception as e:
             print(f"An error occurred while getting changed Ids for {entity}: {str(e)}")
+            raise
+
+        upserts, deletes = change_set.upserts, change_set.deletes
+        print(f"Found {change_set.change_count} changes for {entity} since version {latest_version}: "
+              f"{len(upserts)} objects to upsert, {len(deletes)} deleted, "
+              f"{change_set.change_count - len(change_set)} duplicates dropped")
+        metrics.incr('api.changed_ids', len(upserts))
+        metrics.incr('api.deleted_ids', len(deletes))
 
-    return changed_ids
+    return change_set
 
 
 def update_latest_version(entities):
     """
-    Updates the latest version for the given entities.
+    Looks up the latest version of the given entities.
+
+    Only the head of each changes feed is requested (a single request with SIZE=1, newest
+    change first). Runs that fetched the changes feed can use the `latest_version` of the
+    change sets returned by `fetch_changed_ids` instead.
 
     Args:
         entities (list): A list of dictionaries containing the entity endpoints and names.
-        cosential_pw (str): The password secret for authentication.
-        cosential_api_key (str): The API key secret for authentication.
 
     Returns:
         dict: A dictionary containing the latest versions for each entity.
@@ -129,17 +622,13 @@ def update_latest_version(entities):
 
     for entity in entities:
         endpoint = entity["Endpoint"]
-        relative_url= f"{endpoint}/changes?reverse=true"
+        relative_url = f"{endpoint}/changes?reverse=true"
         entity_name = entity["Entity"]
 
-        # Custom headers
-
-
         try:
-            response = make_api_call(relative_url)  # Make the API call to get the latest version
-            latest_version = response.json()[0]["Version"]  # Use index 0 to access the first item in the response
-
-            all_versions[entity_name] = latest_version  # Add the latest version to the dictionary
+            page = next(iter_pages(relative_url, size=1))  # Only the newest change is needed
+            if page:
+                all_versions[entity_name] = page[0]["Version"]
 
         except Exception as e:
             print(f"An error occurred while getting latest version for {entity_name}: {str(e)}")
@@ -147,93 +636,237 @@ def update_latest_version(entities):
     return all_versions
 
 
-def pull_entity_objects(entity_endpoint, object_ids):
+def choose_extraction_strategy(entity_endpoint, change_count):
     """
-    Pulls the objects for a given entity endpoint.
+    Chooses how to pull the changed objects of an entity.
+
+    A `bulk` pull pages through the entity's list endpoint and keeps the changed objects,
+    costing about EstimatedTotal / SIZE requests. A `per_id` pull costs one request per
+    changed object. The following keys in cosential_entities.json control the choice:
+
+    - ExtractionStrategy: `per_id`, `bulk` or `auto` (default).
+    - IdField: the ID field of the list payload. Bulk pulls are only possible when it is set.
+    - BulkMinChanges: switch to bulk at this many changed objects.
+    - EstimatedTotal and BulkChangeRatio: switch to bulk once the changed objects reach this share
+      of the entity's size (BulkChangeRatio defaults to COSENTIAL_BULK_CHANGE_RATIO).
+
+    EstimatedTotal is maintained by hand and is not checked against the API, so it should be
+    kept close to the entity's real size. Without it (or BulkMinChanges), `auto` always pulls
+    per ID, which is logged as a warning.
 
     Args:
         entity_endpoint (dict): A dictionary containing the entity endpoint and name.
-        object_ids (dict): A dictionary containing the object IDs for the entity.
-        cosential_pw (str): The password secret for authentication.
-        cosential_api_key (str): The API key secret for authentication.
+        change_count (int): The number of changed objects.
 
     Returns:
-        list: A list of dictionaries containing the data for the specified entity objects.
+        str: `bulk` or `per_id`.
+    """
+    strategy = entity_endpoint.get("ExtractionStrategy", "auto")
+    if strategy in ("bulk", "per_id"):
+        return strategy if entity_endpoint.get("IdField") or strategy == "per_id" else "per_id"
+
+    if not entity_endpoint.get("IdField") or change_count == 0:
+        return "per_id"
+
+    min_changes = entity_endpoint.get("BulkMinChanges")
+    if min_changes is not None and change_count >= int(min_changes):
+        return "bulk"
+
+    estimated_total = entity_endpoint.get("EstimatedTotal")
+    if not estimated_total and min_changes is None:
+        logger.warning(f"{entity_endpoint['Entity']} has an IdField but no EstimatedTotal or BulkMinChanges, "
+                       f"so {change_count} changed objects are pulled per ID")
+    change_ratio = float(entity_endpoint.get("BulkChangeRatio") or default_bulk_change_ratio)
+    if estimated_total and change_count >= change_ratio * int(estimated_total):
+        return "bulk"
+
+    return "per_id"
+
+
+def iter_entity_objects_bulk(entity_endpoint, object_ids, failures=None):
     """
+    Pulls the objects for a given entity endpoint by paging through its list endpoint, yielding them as they are found.
 
+    Records are filtered on the entity's `IdField` as each page arrives, and paging stops once
+    every requested object was found. Objects are yielded in the order of the list endpoint,
+    so only the requested IDs are held in memory, not the objects.
+
+    Args:
+        entity_endpoint (dict): A dictionary containing the entity endpoint, name and IdField.
+        object_ids (dict): A dictionary containing the object IDs for the entity.
+        failures (list, optional): A list to which (object_id, error message) tuples are
+            appended for every object that was not found.
+
+    Yields:
+        tuple: The object ID and the data of each object that was found.
+    """
     endpoint = entity_endpoint["Endpoint"]
     entity = entity_endpoint["Entity"]
+    id_field = entity_endpoint["IdField"]
 
     if entity not in object_ids or not object_ids[entity]:
-        return []  # Return an empty list if there are no object_ids for this entity
+        return  # Nothing to pull if there are no object_ids for this entity
 
-    aggregated_data = []  # List to hold all objects for the current entity
+    remaining = set(object_ids[entity])
 
-    for object_id in object_ids[entity]:
-        relative_url = f"{endpoint}/{object_id}"
+    for record in iter_records(endpoint):
+        object_id = record.get(id_field)
+        if object_id in remaining:
+            remaining.discard(object_id)
+            yield object_id, record
+            if not remaining:
+                break
 
-        # Make the API call and return response
-        try:
-            response = make_api_call(relative_url)
+    entity_failures = [(object_id, "Not found in list endpoint") for object_id in object_ids[entity] if object_id in remaining]
 
-            # Append response data to aggregated_data
-            aggregated_data.append(response.json())
+    report_failures(entity, entity_failures, len(object_ids[entity]))
+    if failures is not None:
+        failures.extend(entity_failures)
 
-        except Exception as e:
-            print(f"An error occurred while pulling data for {entity} with ID {object_id}: {str(e)}")
-    return aggregated_data
 
+def iter_entity_objects(entity_endpoint, object_ids, failures=None, strategy=None):
+    """
+    Pulls the objects for a given entity endpoint, yielding them as they arrive.
+
+    Objects are requested concurrently (see `fetch_concurrently`) and yielded in the
+    order of the object IDs. When the bulk strategy applies (see `choose_extraction_strategy`),
+    they are taken from the paged list endpoint instead, in its order (see `iter_entity_objects_bulk`).
+    Failures are reported once every object was attempted.
+
+    Args:
+        entity_endpoint (dict): A dictionary containing the entity endpoint and name.
+        object_ids (dict): A dictionary containing the object IDs for the entity.
+        failures (list, optional): A list to which (object_id, error message) tuples are
+            appended for every object that could not be pulled.
+        strategy (str, optional): `bulk` or `per_id`. Chosen from the number of object IDs when omitted.
+
+    Yields:
+        tuple: The object ID and the data of each object that was pulled.
+    """
+
+    endpoint = entity_endpoint["Endpoint"]
+    entity = entity_endpoint["Entity"]
+
+    if entity not in object_ids or not object_ids[entity]:
+        return  # Nothing to pull if there are no object_ids for this entity
+
+    strategy = strategy or choose_extraction_strategy(entity_endpoint, len(object_ids[entity]))
+    if strategy == "bulk":
+        logger.info(f"Pulling {len(object_ids[entity])} changed {entity} from the list endpoint")
+        yield from iter_entity_objects_bulk(entity_endpoint, object_ids, failures)
+        return
+
+    def fetch_object(object_id):
+        return fetch_api_data(f"{endpoint}/{object_id}")
 
+    entity_failures = []
+    yield from fetch_concurrently(object_ids[entity], fetch_object, get_max_workers(entity_endpoint), entity_failures)
 
-def pull_entity_arrays(entity, array_name, object_ids):
+    report_failures(entity, entity_failures, len(object_ids[entity]))
+    if failures is not None:
+        failures.extend(entity_failures)
+
+
+def pull_entity_objects(entity_endpoint, object_ids, failures=None, strategy=None):
     """
     Pulls the objects for a given entity endpoint.
 
     Args:
-        entity (dict): A dictionary containing the entity endpoint and name.
-        array_name (str): The name of the array to pull.
+        entity_endpoint (dict): A dictionary containing the entity endpoint and name.
         object_ids (dict): A dictionary containing the object IDs for the entity.
-        cosential_pw (str): The password secret for authentication.
-        cosential_api_key (str): The API key secret for authentication.
+        failures (list, optional): A list to which (object_id, error message) tuples are
+            appended for every object that could not be pulled.
+        strategy (str, optional): `bulk` or `per_id` (see `iter_entity_objects`).
 
     Returns:
         list: A list of dictionaries containing the data for the specified entity objects.
     """
+    return [data for _, data in iter_entity_objects(entity_endpoint, object_ids, failures, strategy)]
+
+
+
+def iter_entity_arrays(entity, array_name, object_ids, failures=None):
+    """
+    Pulls the array values of the given objects for a given entity endpoint, yielding them as they arrive.
+
+    Arrays are requested concurrently (see `fetch_concurrently`) and yielded in the
+    order of the object IDs, with the parent object ID stamped on every item as `ObjectId`.
+    Failures are reported once every array was attempted.
+
+    Args:
+        entity (dict): A dictionary containing the entity endpoint and name.
+        array_name (str): The name of the array to pull.
+        object_ids (dict): A dictionary containing the object IDs for the entity.
+        failures (list, optional): A list to which (object_id, error message) tuples are
+            appended for every object whose array could not be pulled.
+
+    Yields:
+        dict: The array values.
+    """
     endpoint = entity["Endpoint"]
     entity_name = entity["Entity"]
 
     if entity_name not in object_ids or not object_ids[entity_name]:
-        return []  # Return an empty list if there are no object_ids for this entity
+        return  # Nothing to pull if there are no object_ids for this entity
 
-    aggregated_data = []  # List to hold all objects for the current entity
+    def fetch_array(object_id):
+        response_data = fetch_api_data(f"{endpoint}/{object_id}/{array_name}")
 
-    for object_id in object_ids[entity_name]:
-        relative_url = f"{endpoint}/{object_id}/{array_name}"
-        # Make the API call and return response
-        try:
-            response = make_api_call(relative_url)
-
-            # Append response data to aggregated_data
-            response_data = response.json()
-
-            if isinstance(response_data, dict):
-                response_data["ObjectId"] = object_id
-                aggregated_data.append(response_data)
-            elif isinstance(response_data, list):
-                for item in response_data:
-                    if isinstance(item, dict):
-                        item["ObjectId"] = object_id
-                aggregated_data.extend(response_data)
-            else:
-                print(f"Unexpected response data type for {entity_name} with ID {object_id}: {type(response_data)}")
-                print(response_data)
-
-        except requests.exceptions.RequestException as e:
-            print(f"An error occurred while pulling data for {entity_name} with ID {object_id}: {str(e)}")
-        except Exception as e:
-            print(f"An unexpected error occurred while processing data for {entity_name} with ID {object_id}: {str(e)}")
+        if isinstance(response_data, dict):
+            response_data["ObjectId"] = object_id
+            return [response_data]
+        elif isinstance(response_data, list):
+            for item in response_data:
+                if isinstance(item, dict):
+                    item["ObjectId"] = object_id
+            return response_data
+        else:
+            raise TypeError(f"Unexpected response data type: {type(response_data)}")
 
-    return aggregated_data
+    entity_failures = []
+
+    for _, response_data in fetch_concurrently(
+        object_ids[entity_name], fetch_array, get_max_workers(entity), entity_failures
+    ):
+        yield from response_data
+
+    report_failures(f"{entity_name}/{array_name}", entity_failures, len(object_ids[entity_name]))
+    if failures is not None:
+        failures.extend(entity_failures)
+
+
+def pull_entity_arrays(entity, array_name, object_ids, failures=None):
+    """
+    Pulls the array values of the given objects for a given entity endpoint.
+
+    Args:
+        entity (dict): A dictionary containing the entity endpoint and name.
+        array_name (str): The name of the array to pull.
+        object_ids (dict): A dictionary containing the object IDs for the entity.
+        failures (list, optional): A list to which (object_id, error message) tuples are
+            appended for every object whose array could not be pulled.
+
+    Returns:
+        list: A list of dictionaries containing the data for the specified entity objects.
+    """
+    return list(iter_entity_arrays(entity, array_name, object_ids, failures))
+
+
+def iter_all_entities(entity_endpoints):
+    """
+    Yields the objects of multiple entities from their respective endpoints, page by page.
+
+    Args:
+        entity_endpoints (list): A list of dictionaries containing the endpoint and entity information for each entity.
+
+    Yields:
+        dict: An object of one of the entities.
+
+    Raises:
+        requests.exceptions.RequestException: If an error occurs while pulling data for any entity.
+    """
+    for entity_endpoint in entity_endpoints:
+        yield from iter_records(entity_endpoint["Endpoint"])
 
 
 def pull_all_entities(entity_endpoints):
@@ -244,23 +877,17 @@ def pull_all_entities(entity_endpoints):
         entity_endpoints (list): A list of dictionaries containing the endpoint and entity information for each entity.
 
     Returns:
-        list: A list of all objects for all entities.
-
-    Raises:
-        Exception: If an error occurs while pulling data for any entity.
+        list: A list of all objects for all entities, or False if an error occurred.
     """
 
     aggregated_data = []  # List to hold all objects for all entities
 
     for entity_endpoint in entity_endpoints:
-        endpoint = entity_endpoint["Endpoint"]
         entity = entity_endpoint["Entity"]
-        relative_url = f"{endpoint}"
 
         # Make the API call and return response
         try:
-            response_data = make_api_call(relative_url)
-            aggregated_data.extend(response_data)
+            aggregated_data.extend(iter_all_entities([entity_endpoint]))
 
         except Exception as e:
             print(f"An error occurred while pulling data for {entity}: {str(e)}")
@@ -1,31 +1,200 @@
-from azure.storage.blob import BlobServiceClient
+from azure.core.exceptions import ResourceNotFoundError
+from azure.core.pipeline.transport import RequestsTransport
+from azure.storage.blob import BlobSasPermissions, BlobServiceClient, generate_blob_sas
+import base64
+import codecs
+from datetime import datetime, timedelta, timezone
 import json
 import os
+import tempfile
 from azure.identity import DefaultAzureCredential
-from plugins.azure_utils import get_secret
 from azure.keyvault.secrets import SecretClient
-from sqlalchemy import create_engine, Column, Integer, String, MetaData, Table, Float, DateTime, Text, inspect, Boolean
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, Column, Integer, String, MetaData, Table, Float, DateTime, Text, Boolean, bindparam, text
+import itertools
+import threading
+import time
 import urllib
+import zlib
+import requests
+from requests.adapters import HTTPAdapter
+from plugins import metrics
 
+try:
+    import zstandard
+except ImportError:  # zstd landing files are optional
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # the Parquet landing zone is optional
+    pyarrow = None
+
+# Secrets are read from Key Vault on first use and cached (see get_secret),
+# so importing this module never makes a network call.
 adls_connection_string_secret_name = os.getenv('ADLS_CONNECTION_STRING_SECRET')
 keyvault_url = os.environ.get("KEYVAULT_URL")
 sql_password_secret_name = os.getenv('SQL_PW_SECRET')
 
-#Defines the connection string to the STORAGE ACCOUNT in Azure Data Lake Storage (ADLS)
-adls_connection_string = get_secret(adls_connection_string_secret_name)
-
 # Defines the elements of the connection string to the SQL SERVER in Azure SQL Database
 server = os.environ.get("SQL_SERVER")
 database = os.environ.get("DATABASE")
 sql_username = os.environ.get("SQL_USER")
-sql_password = get_secret(sql_password_secret_name)
 driver = os.environ.get("DRIVER")
 
+# Local snapshots of metadata blobs used while parsing DAGs (see load_metadata_snapshot)
+metadata_cache_dir = os.getenv('METADATA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'cosential_metadata'))
+metadata_cache_ttl = int(os.getenv('METADATA_CACHE_TTL', '900'))
+
+# Number of rows sent per executemany call (and committed per transaction) by write_data_azure_sql
+sql_batch_size = int(os.getenv('SQL_BATCH_SIZE', '5000'))
+sql_echo = os.getenv('SQL_ECHO', 'false').lower() == 'true'
+
+# Connection pool settings for the engine shared by all loads in a worker process
+sql_pool_size = int(os.getenv('SQL_POOL_SIZE', '5'))
+sql_max_overflow = int(os.getenv('SQL_MAX_OVERFLOW', '5'))
+sql_pool_recycle = int(os.getenv('SQL_POOL_RECYCLE', '1800'))
+
+_engine = None
+_engine_pid = None
+_engine_lock = threading.Lock()
+
+# Tables already known to exist, keyed by table name and column definitions
+_table_registry = {}
+_table_registry_lock = threading.Lock()
+
+# Key Vault secrets cached per process: seconds a value is used, and the fraction of that
+# after which it is refreshed in the background
+secret_cache_ttl = int(os.getenv('SECRET_CACHE_TTL', '3600'))
+secret_refresh_ahead = float(os.getenv('SECRET_REFRESH_AHEAD', '0.75'))
+
+_secret_client = None
+_secret_client_pid = None
+_secret_client_lock = threading.Lock()
+_secret_cache = {}
+_secret_locks = {}
+_secret_refreshing = set()
+_secret_cache_lock = threading.Lock()
+
+# Storage clients shared per process; BLOB_POOL_SIZE bounds the keep-alive connections they use
+blob_pool_size = int(os.getenv('BLOB_POOL_SIZE', '16'))
+blob_chunk_size = int(os.getenv('BLOB_CHUNK_SIZE', str(4 * 1024 * 1024)))
+blob_block_size = int(os.getenv('BLOB_BLOCK_SIZE', str(4 * 1024 * 1024)))
+blob_copy_block_size = 100 * 1024 * 1024
+
+_blob_service_client = None
+_blob_service_client_pid = None
+_container_clients = {}
+_blob_client_lock = threading.Lock()
+
+# Format of the record blobs landed by process_entity: json, ndjson, ndjson.gz or ndjson.zst
+landing_format = os.getenv('LANDING_FORMAT', 'json')
+landing_formats = ('json', 'ndjson', 'ndjson.gz', 'ndjson.zst')
+compressed_chunk_size = 1024 * 1024
+
+# Typed Parquet copies of every schema table, written next to the landed blobs when enabled
+write_parquet = os.getenv('WRITE_PARQUET', 'false').lower() == 'true'
+parquet_spool_size = 64 * 1024 * 1024
+
+def get_secret_client():
+    """
+    Returns the Key Vault client shared by the current process.
+
+    The DefaultAzureCredential behind it is created once, so credential discovery runs
+    once per process and its access token is reused until it expires.
+
+    Returns:
+        azure.keyvault.secrets.SecretClient: The shared Key Vault client.
+    """
+    global _secret_client, _secret_client_pid
+
+    pid = os.getpid()
+    if _secret_client is None or _secret_client_pid != pid:
+        with _secret_client_lock:
+            if _secret_client is None or _secret_client_pid != pid:
+                # Create an instance of the DefaultAzureCredential class. Will look for environment variables first, then managed identity, then interactive login.
+                credential = DefaultAzureCredential()
+
+                # Create an instance of the SecretClient class
+                _secret_client = SecretClient(vault_url=keyvault_url, credential=credential)
+                _secret_client_pid = pid
+
+    return _secret_client
+
+
+
+def load_secret(secret_name, loaded_before=None):
+    """
+    Retrieves a secret value from Azure Key Vault and stores it in the secret cache.
+
+    Concurrent calls for the same secret are de-duplicated: one thread makes the request
+    while the others wait for it and reuse its result.
+
+    Args:
+        secret_name (str): The name of the secret to retrieve.
+        loaded_before (float, optional): Only reload if the cached value was loaded before this
+            `time.monotonic()` timestamp. Defaults to reloading when the value has expired.
+
+    Returns:
+        str: The value of the secret.
+    """
+    with _secret_cache_lock:
+        lock = _secret_locks.setdefault(secret_name, threading.Lock())
+
+    with lock:
+        cached = _secret_cache.get(secret_name)
+        if cached is not None:
+            value, loaded_at = cached
+            if loaded_before is None:
+                if time.monotonic() - loaded_at < secret_cache_ttl:
+                    return value
+            elif loaded_at >= loaded_before:
+                return value
+
+        # Retrieve the secret value from Azure Key Vault
+        value = get_secret_client().get_secret(secret_name).value
+        _secret_cache[secret_name] = (value, time.monotonic())
+        return value
+
+
+
+def refresh_secret(secret_name, loaded_at):
+    """
+    Reloads a cached secret in a background thread, keeping the cached value on failure.
+
+    Args:
+        secret_name (str): The name of the secret to reload.
+        loaded_at (float): The load time of the cached value being replaced.
+
+    Returns:
+        None
+    """
+    with _secret_cache_lock:
+        if secret_name in _secret_refreshing:
+            return
+        _secret_refreshing.add(secret_name)
+
+    def refresh():
+        try:
+            load_secret(secret_name, loaded_before=loaded_at + 1e-9)
+        except Exception as e:
+            print(f"Error refreshing secret {secret_name}: {e}")
+        finally:
+            with _secret_cache_lock:
+                _secret_refreshing.discard(secret_name)
+
+    threading.Thread(target=refresh, name=f'refresh-secret-{secret_name}', daemon=True).start()
+
+
+
 def get_secret(secret_name):
     """
     Retrieves a secret value from Azure Key Vault.
 
+    Values are cached per process for SECRET_CACHE_TTL seconds. Once a cached value is
+    older than SECRET_REFRESH_AHEAD of its TTL, it is still returned but reloaded in the
+    background, so callers only wait on Key Vault for the first lookup of each secret.
+
     Args:
         secret_name (str): The name of the secret to retrieve.
 
@@ -37,27 +206,61 @@ def get_secret(secret_name):
         azure.core.exceptions.ClientAuthenticationError: If the authentication fails.
         azure.core.exceptions.ServiceRequestError: If there is an error making the request to Azure Key Vault.
     """
-    # Create an instance of the DefaultAzureCredential class. Will look for environment variables first, then managed identity, then interactive login.
-    credential = DefaultAzureCredential()
+    cached = _secret_cache.get(secret_name)
+    if cached is not None:
+        value, loaded_at = cached
+        age = time.monotonic() - loaded_at
+        if age < secret_cache_ttl:
+            if age >= secret_cache_ttl * secret_refresh_ahead:
+                refresh_secret(secret_name, loaded_at)
+            return value
 
-    # Create an instance of the SecretClient class
-    client = SecretClient(vault_url=keyvault_url, credential=credential)
+    return load_secret(secret_name)
 
-    # Retrieve the secret value from Azure Key Vault
-    secret = client.get_secret(secret_name).value
-    return secret
 
 
+def get_adls_connection_string():
+    """
+    Returns the connection string to the STORAGE ACCOUNT in Azure Data Lake Storage (ADLS).
 
-def write_data_azure_storage(data_export, container_name, entity_name, blob_name):
+    The secret is read from Azure Key Vault on first use and then served from the secret cache.
+
+    Returns:
+        str: The ADLS connection string.
+    """
+    return get_secret(adls_connection_string_secret_name)
+
+
+
+def get_sql_password():
+    """
+    Returns the password for the SQL SERVER in Azure SQL Database.
+
+    The secret is read from Azure Key Vault on first use and then served from the secret cache.
+
+    Returns:
+        str: The SQL password.
+    """
+    return get_secret(sql_password_secret_name)
+
+
+
+def write_data_azure_storage(data_export, container_name, entity_name, blob_name, landing_format=None):
     """
     Uploads JSON data to Azure Storage Blob.
 
+    When `landing_format` is given, `data_export` is an iterable of records that is encoded
+    in that format as it is uploaded (see `iter_encoded_records`), and the `.json` extension
+    of `blob_name` is replaced to match (see `landing_blob_name`).
+
     Args:
-        data_export (dict): The JSON data to upload.
+        data_export (str | iterable): The JSON data to upload, either as a string or as an
+            iterable of chunks (see `iter_json_array`) that is uploaded as it is consumed.
+            With `landing_format`, the records to upload.
         container_name (str): The name of the Azure Storage container.
         entity_name (str): The name of the entity.
-        connection_string (str): The connection string for Azure Storage.
+        blob_name (str): The name of the blob, relative to the entity folder.
+        landing_format (str, optional): One of `landing_formats`.
 
     Returns:
         str: The URL of the uploaded blob.
@@ -71,26 +274,556 @@ def write_data_azure_storage(data_export, container_name, entity_name, blob_name
         print(f"Uploading JSON data for entity: {entity}")
         
         
-        blob_service_client = BlobServiceClient.from_connection_string(adls_connection_string)
+        if landing_format is not None:
+            data_export = iter_encoded_records(data_export, landing_format)
+            blob_name = landing_blob_name(blob_name, landing_format)
+
+        container_client = get_container_client(container_name)
         blob_path = os.path.join(entity, blob_name)
         print(f"Blob path: {blob_path}")
         
-        blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_path)
-        
-        blob_client.upload_blob(data_export, overwrite=True)
+        blob_client = container_client.get_blob_client(blob_path)
+
+        if isinstance(data_export, (str, bytes)):
+            data = data_export.encode('UTF-8') if isinstance(data_export, str) else data_export
+            metrics.incr('blob.upload.bytes', len(data))
+            with metrics.timer('blob.upload.duration'):
+                blob_client.upload_blob(data, overwrite=True)
+        else:
+            # Streamed uploads include the time spent producing the data
+            with metrics.timer('blob.upload.duration'):
+                upload_blob_in_blocks(blob_client, data_export)
+        metrics.incr('blob.uploads')
         
         print(f"Upload Successful: JSON data for {entity} to {container_name}/{blob_path}")
-        return f'https://{blob_service_client.account_name}.blob.core.windows.net/{container_name}/{blob_path}'
+        return f'https://{container_client.account_name}.blob.core.windows.net/{container_name}/{blob_path}'
     except Exception as e:
         print(f"Error: {e}")
         return False
 
 
 
+def get_block_id(index):
+    """
+    Returns the ID of the block at a position of a block blob.
+
+    Block IDs must have the same length within a blob, so the position is zero padded.
+
+    Args:
+        index (int): The position of the block.
+
+    Returns:
+        str: The base64 encoded block ID.
+    """
+    return base64.b64encode(f'{index:08d}'.encode('ascii')).decode('ascii')
+
+
+
+def upload_blob_in_blocks(blob_client, chunks, block_size=None):
+    """
+    Uploads a stream of chunks as a block blob, staging a block whenever `block_size` bytes are buffered.
+
+    Only one block is held in memory at a time, however large the stream is. The blob is
+    created (or replaced) when the block list is committed at the end, so an interrupted
+    upload never leaves a partial blob behind; its uncommitted blocks are discarded by the service.
+
+    Args:
+        blob_client (azure.storage.blob.BlobClient): The client of the blob to write.
+        chunks (iterable): The chunks of the blob, as str (encoded as UTF-8) or bytes.
+        block_size (int, optional): The size of the staged blocks. Defaults to BLOB_BLOCK_SIZE.
+
+    Returns:
+        int: The number of bytes uploaded.
+    """
+    block_size = block_size or blob_block_size
+    block_ids = []
+    buffer = bytearray()
+    size = 0
+
+    def stage(data):
+        block_id = get_block_id(len(block_ids))
+        blob_client.stage_block(block_id, bytes(data))
+        block_ids.append(block_id)
+        metrics.incr('blob.upload.blocks')
+        metrics.incr('blob.upload.bytes', len(data))
+
+    for chunk in chunks:
+        buffer += chunk.encode('UTF-8') if isinstance(chunk, str) else chunk
+        while len(buffer) >= block_size:
+            stage(buffer[:block_size])
+            del buffer[:block_size]
+            size += block_size
+
+    if buffer:
+        stage(buffer)
+        size += len(buffer)
+
+    # An empty block list creates an empty blob
+    blob_client.commit_block_list(block_ids)
+    return size
+
+
+
+def get_blob_source_url(blob_client):
+    """
+    Returns a URL from which the storage service can read a blob, e.g. to copy it with `stage_block_from_url`.
+
+    With an account key, a read-only SAS valid for an hour is added. Otherwise the client's URL
+    is returned as is, which carries the SAS token of a SAS connection string.
+
+    Args:
+        blob_client (azure.storage.blob.BlobClient): The client of the blob.
+
+    Returns:
+        str: The URL of the blob.
+    """
+    account_key = getattr(blob_client.credential, 'account_key', None)
+    if not account_key:
+        return blob_client.url
+
+    sas_token = generate_blob_sas(
+        blob_client.account_name, blob_client.container_name, blob_client.blob_name,
+        account_key=account_key,
+        permission=BlobSasPermissions(read=True),
+        expiry=datetime.now(timezone.utc) + timedelta(hours=1),
+    )
+    return f'{blob_client.url}?{sas_token}'
+
+
+
+def assemble_blob(container_name, blob_name, part_names, format_name=None):
+    """
+    Concatenates part blobs into one block blob, on the storage service.
+
+    Every part is copied into blocks of the new blob with Put Block From URL, so no data passes
+    through the worker, and the blob appears once its block list is committed. Concatenated
+    NDJSON parts (also gzip members and zstd frames) are valid as they are. For the `json` format,
+    only the items of each part's array are copied, and the brackets and separators between
+    them are staged as small blocks.
+
+    Args:
+        container_name (str): The name of the Azure Storage container.
+        blob_name (str): The name of the blob to write.
+        part_names (list): The names of the part blobs, in order.
+        format_name (str, optional): The landing format of the parts. Defaults to LANDING_FORMAT.
+
+    Returns:
+        int: The number of bytes copied from the parts.
+    """
+    format_name = format_name or landing_format
+    container_client = get_container_client(container_name)
+    blob_client = container_client.get_blob_client(blob_name)
+    block_ids = []
+    size = 0
+
+    def stage(data):
+        block_id = get_block_id(len(block_ids))
+        blob_client.stage_block(block_id, data)
+        block_ids.append(block_id)
+
+    def stage_range(source_url, offset, length):
+        while length > 0:
+            block_length = min(length, blob_copy_block_size)
+            block_id = get_block_id(len(block_ids))
+            blob_client.stage_block_from_url(block_id, source_url, source_offset=offset, source_length=block_length)
+            block_ids.append(block_id)
+            offset += block_length
+            length -= block_length
+
+    if format_name == 'json':
+        stage(b'[')
+    separator = b''
+
+    for part_name in part_names:
+        part_client = container_client.get_blob_client(part_name)
+        offset, length = 0, part_client.get_blob_properties().size
+
+        if format_name == 'json':
+            # A part is `[`, then the items each preceded by `\n` and separated by `,`, then `\n]`
+            offset, length = 1, length - 3
+            if length <= 0:
+                continue
+            if separator:
+                stage(separator)
+            separator = b','
+
+        stage_range(get_blob_source_url(part_client), offset, length)
+        size += length
+
+    if format_name == 'json':
+        stage(b'\n]')
+
+    blob_client.commit_block_list(block_ids)
+    metrics.incr('blob.assembled.bytes', size)
+    print(f"Assembled {container_name}/{blob_name} from {len(part_names)} parts ({size} bytes)")
+    return size
+
+
+
+def get_blob_service_client():
+    """
+    Returns the BlobServiceClient shared by the current process.
+
+    The client is created on first use with a pooled keep-alive HTTP transport, so
+    consecutive uploads and downloads reuse connections to the storage account
+    instead of setting up a new client and connection per blob.
+
+    Returns:
+        azure.storage.blob.BlobServiceClient: The shared storage client.
+    """
+    global _blob_service_client, _blob_service_client_pid
+
+    pid = os.getpid()
+    if _blob_service_client is None or _blob_service_client_pid != pid:
+        with _blob_client_lock:
+            if _blob_service_client is None or _blob_service_client_pid != pid:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=blob_pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+
+                _blob_service_client = BlobServiceClient.from_connection_string(
+                    get_adls_connection_string(),
+                    transport=RequestsTransport(session=session, session_owner=False),
+                    max_single_get_size=blob_chunk_size,
+                    max_chunk_get_size=blob_chunk_size,
+                )
+                _blob_service_client_pid = pid
+                _container_clients.clear()
+
+    return _blob_service_client
+
+
+
+def get_container_client(container_name):
+    """
+    Returns the ContainerClient for a container, shared by all threads of the process.
+
+    Args:
+        container_name (str): The name of the Azure Storage container.
+
+    Returns:
+        azure.storage.blob.ContainerClient: The container client.
+    """
+    blob_service_client = get_blob_service_client()
+
+    with _blob_client_lock:
+        container_client = _container_clients.get(container_name)
+        if container_client is None:
+            container_client = blob_service_client.get_container_client(container_name)
+            _container_clients[container_name] = container_client
+
+    return container_client
+
+
+
+def iter_json_array(records):
+    """
+    Serializes records into a JSON array one record at a time.
+
+    The chunks can be passed straight to `write_data_azure_storage`, so records are
+    uploaded as they are produced instead of being serialized into one large string.
+
+    Args:
+        records (iterable): The records to serialize.
+
+    Yields:
+        str: Consecutive chunks of the JSON document.
+    """
+    yield '['
+    separator = '\n'
+    for record in records:
+        yield separator + json.dumps(record, ensure_ascii=False, indent=4)
+        separator = ',\n'
+    yield '\n]'
+
+
+
+def landing_blob_name(blob_name, format_name=None):
+    """
+    Returns the name under which a `.json` record blob is landed in the given format.
+
+    Args:
+        blob_name (str): The blob name with a `.json` extension (e.g. `run=temp.json`).
+        format_name (str, optional): One of `landing_formats`. Defaults to LANDING_FORMAT.
+
+    Returns:
+        str: The blob name with the extension of the landing format (e.g. `run=temp.ndjson.gz`).
+    """
+    format_name = format_name or landing_format
+    if format_name not in landing_formats:
+        raise ValueError(f"Unknown landing format {format_name}, expected one of {landing_formats}")
+
+    root, extension = os.path.splitext(blob_name)
+    if extension != '.json':
+        return blob_name
+    return f'{root}.{format_name}'
+
+
+
+def iter_encoded_records(records, landing_format):
+    """
+    Encodes records in a landing format one record at a time.
+
+    Args:
+        records (iterable): The records to encode.
+        landing_format (str): One of `landing_formats`.
+
+    Yields:
+        str | bytes: Consecutive chunks of the encoded blob.
+    """
+    if landing_format == 'json':
+        yield from iter_json_array(records)
+        return
+
+    lines = (json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n' for record in records)
+
+    if landing_format == 'ndjson':
+        yield from lines
+        return
+
+    if landing_format == 'ndjson.gz':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip container
+    elif landing_format == 'ndjson.zst':
+        if zstandard is None:
+            raise ImportError("The zstandard package is required for the ndjson.zst landing format")
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        raise ValueError(f"Unknown landing format {landing_format}, expected one of {landing_formats}")
+
+    buffer = []
+    buffered = 0
+    for line in lines:
+        data = compressor.compress(line.encode('utf-8'))
+        if data:
+            buffer.append(data)
+            buffered += len(data)
+        if buffered >= compressed_chunk_size:
+            yield b''.join(buffer)
+            buffer = []
+            buffered = 0
+    buffer.append(compressor.flush())
+    yield b''.join(buffer)
+
+
+
+def iter_decompressed(chunks):
+    """
+    Decompresses a stream of blob chunks, detecting gzip and zstd from their magic bytes.
+
+    Uncompressed streams are passed through unchanged.
+
+    Args:
+        chunks (iterable): The raw chunks of the blob.
+
+    Yields:
+        bytes: The decompressed chunks.
+    """
+    chunks = iter(chunks)
+    first = b''
+    for chunk in chunks:
+        first += chunk
+        if len(first) >= 4:
+            break
+
+    if first[:2] == b'\x1f\x8b':
+        def new_decompressor():
+            return zlib.decompressobj(47)
+    elif first[:4] == b'\x28\xb5\x2f\xfd':
+        if zstandard is None:
+            raise ImportError("The zstandard package is required to read zstd compressed blobs")
+
+        def new_decompressor():
+            return zstandard.ZstdDecompressor().decompressobj()
+    else:
+        yield first
+        yield from chunks
+        return
+
+    decompressor = new_decompressor()
+    for chunk in itertools.chain([first], chunks):
+        while chunk:
+            # Concatenated gzip members or zstd frames continue in a new decompressor,
+            # also when the previous member ended exactly at the end of a chunk
+            if decompressor.eof:
+                decompressor = new_decompressor()
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+
+            chunk = decompressor.unused_data if decompressor.eof else b''
+
+
+
+def iter_ndjson(chunks):
+    """
+    Parses newline-delimited JSON from a stream of chunks, one record at a time.
+
+    Args:
+        chunks (iterable): The decompressed chunks.
+
+    Yields:
+        dict: The parsed records.
+    """
+    remainder = b''
+    for chunk in chunks:
+        lines = (remainder + chunk).split(b'\n')
+        remainder = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if remainder.strip():
+        yield json.loads(remainder)
+
+
+
+def iter_json_items(chunks):
+    """
+    Parses a JSON document from a stream of chunks, yielding the items of its top-level array.
+
+    Items are decoded as soon as they are complete, so only the current item and one
+    chunk are held in memory. A document that is not an array is yielded whole.
+
+    Args:
+        chunks (iterable): The decompressed chunks of the document.
+
+    Yields:
+        dict: The items of the top-level array.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+    exhausted = False
+
+    def read_more():
+        nonlocal buffer, position, exhausted
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            buffer = buffer[position:] + text_decoder.decode(b'', final=True)
+        else:
+            buffer = buffer[position:] + text_decoder.decode(chunk)
+        position = 0
+
+    def skip(characters):
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in characters:
+                position += 1
+            if position < len(buffer) or exhausted:
+                return
+            read_more()
+
+    skip(' \t\r\n\ufeff')
+    if position >= len(buffer):
+        return
+
+    if buffer[position] != '[':
+        while not exhausted:
+            read_more()
+        yield json.loads(buffer[position:])
+        return
+
+    position += 1
+    while True:
+        skip(' \t\r\n,')
+        if position >= len(buffer):
+            raise ValueError("Unexpected end of JSON array")
+        if buffer[position] == ']':
+            return
+
+        # Decode the next item once it is complete. A number cut off by the end of the buffer
+        # may go on in the next chunk, also after a `.`, exponent or sign (e.g. `2.` or `1e`)
+        while True:
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+                if exhausted or (end < len(buffer) and buffer[end] not in '.eE+-'):
+                    break
+            except json.JSONDecodeError:
+                if exhausted:
+                    raise
+            read_more()
+
+        position = end
+        yield item
+
+
+
+def iter_records_azure_storage(container_name, blob_name):
+    """
+    Streams the records of a landed blob, decoding them while the blob downloads.
+
+    The blob is downloaded in BLOB_CHUNK_SIZE chunks. The compression (gzip, zstd or none)
+    is detected from the content and the record format from the blob name: `.ndjson*`
+    blobs are parsed line by line, anything else incrementally as a JSON document whose
+    records are the items of its top-level array (see `iter_json_items`).
+
+    Args:
+        container_name (str): The name of the Azure Storage container.
+        blob_name (str): The name of the blob.
+
+    Yields:
+        dict: The records of the blob.
+    """
+    blob_client = get_container_client(container_name).get_blob_client(blob_name)
+    metrics.incr('blob.downloads')
+    chunks = iter_decompressed(metrics.iter_counted(blob_client.download_blob().chunks(), 'blob.download.bytes'))
+
+    if '.ndjson' in os.path.basename(blob_name):
+        yield from iter_ndjson(chunks)
+    else:
+        yield from iter_json_items(chunks)
+
+
+
+def manifest_blob_name(blob_name):
+    """
+    Returns the name of the manifest listing the part files of a landed blob.
+
+    Args:
+        blob_name (str): The name of the landed blob (e.g. `.../run=temp.ndjson.gz`).
+
+    Returns:
+        str: The name of its manifest (e.g. `.../run=temp.manifest.json`).
+    """
+    directory, file_name = os.path.split(blob_name)
+    return os.path.join(directory, f"{file_name.split('.', 1)[0]}.manifest.json")
+
+
+
+def iter_landed_records(container_name, blob_name):
+    """
+    Streams the records of a landed blob, following its manifest when it was landed in parts.
+
+    Args:
+        container_name (str): The name of the Azure Storage container.
+        blob_name (str): The name of the landed blob.
+
+    Yields:
+        dict: The records of the blob, or of its parts in manifest order.
+    """
+    manifest_client = get_container_client(container_name).get_blob_client(manifest_blob_name(blob_name))
+
+    try:
+        manifest = json.loads(manifest_client.download_blob().readall())
+    except ResourceNotFoundError:
+        yield from iter_records_azure_storage(container_name, blob_name)
+        return
+
+    for part_blob_name in manifest['parts']:
+        yield from iter_records_azure_storage(container_name, part_blob_name)
+
+
+
 def read_from_azure_storage(container_name, blob_name):
     """
     Reads data from Azure Storage Blob.
 
+    Compressed and newline-delimited blobs are detected and decoded automatically
+    (see `iter_records_azure_storage`).
+
     Args:
         container_name (str): The name of the Azure Storage container.
         blob_name (str): The name of the blob.
@@ -104,10 +837,14 @@ def read_from_azure_storage(container_name, blob_name):
         Exception: If an error occurs during the read process.
     """
     try:
-        blob_service_client = BlobServiceClient.from_connection_string(adls_connection_string)
-        blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
-        download_stream = blob_client.download_blob().readall()
-        json_data = json.loads(download_stream)
+        with metrics.timer('blob.download.duration'):
+            if '.ndjson' in os.path.basename(blob_name):
+                json_data = list(iter_records_azure_storage(container_name, blob_name))
+            else:
+                blob_client = get_container_client(container_name).get_blob_client(blob_name)
+                metrics.incr('blob.downloads')
+                chunks = metrics.iter_counted(blob_client.download_blob().chunks(), 'blob.download.bytes')
+                json_data = json.loads(b''.join(iter_decompressed(chunks)))
         print(f"Download Successful: {container_name}/{blob_name}")
         return json_data
     except FileNotFoundError:
@@ -118,6 +855,272 @@ def read_from_azure_storage(container_name, blob_name):
         return False
     
 
+def load_metadata_snapshot(container_name, blob_name, default=None, ttl=None):
+    """
+    Reads a metadata blob through a local snapshot file, for use while parsing DAGs.
+
+    A snapshot younger than `ttl` seconds is returned without any network call. An older
+    snapshot is revalidated against the blob's ETag and only downloaded again when the
+    blob has changed. If Azure cannot be reached, the stale snapshot (or `default` when
+    there is none) is returned so that parsing never fails on storage latency or outages.
+
+    Args:
+        container_name (str): The name of the Azure Storage container.
+        blob_name (str): The name of the blob.
+        default (any, optional): The value returned when no snapshot is available.
+        ttl (int, optional): The snapshot lifetime in seconds. Defaults to METADATA_CACHE_TTL.
+
+    Returns:
+        dict | list: The JSON data of the blob.
+    """
+    ttl = metadata_cache_ttl if ttl is None else ttl
+    snapshot_path = os.path.join(metadata_cache_dir, container_name, blob_name.replace('/', '__'))
+
+    snapshot = None
+    try:
+        with open(snapshot_path, encoding='utf-8') as f:
+            snapshot = json.load(f)
+        if time.time() - snapshot['fetched_at'] < ttl:
+            return snapshot['data']
+    except (OSError, ValueError, KeyError):
+        snapshot = None
+
+    try:
+        blob_client = get_container_client(container_name).get_blob_client(blob_name)
+
+        etag = blob_client.get_blob_properties().etag
+        if snapshot is None or snapshot.get('etag') != etag:
+            download = blob_client.download_blob()
+            snapshot = {'etag': download.properties.etag, 'data': json.loads(download.readall())}
+        snapshot['fetched_at'] = time.time()
+
+        # Write the snapshot atomically so that concurrent parsers never read a partial file
+        os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(snapshot_path))
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f)
+        os.replace(temp_path, snapshot_path)
+
+        return snapshot['data']
+    except Exception as e:
+        print(f"Error refreshing metadata snapshot for {container_name}/{blob_name}: {e}")
+        return snapshot['data'] if snapshot is not None else default
+
+
+
+def coerce_boolean(value):
+    """
+    Converts a value to a boolean.
+
+    Args:
+        value: A bool, 0 or 1, or the text `true` or `false` (in any case).
+
+    Returns:
+        bool | None: The boolean, or None for any other value.
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str):
+        return {'true': True, 'false': False}.get(value.strip().lower())
+    return None
+
+
+
+def coerce_columns(frame, list_columns):
+    """
+    Converts the columns of a DataFrame to the types declared in a table schema.
+
+    Values that cannot be converted become nulls. Nested values in String and Text
+    columns are serialized to JSON.
+
+    Args:
+        frame (pandas.DataFrame): The rows of the table, one column per schema column.
+        list_columns (list): The schema of the table in the form of a list of dictionaries.
+
+    Returns:
+        pandas.DataFrame: The DataFrame with converted columns.
+    """
+    import pandas as pd
+
+    for column in list_columns:
+        name = column['name']
+        column_type = column['type']
+
+        if column_type == 'Integer':
+            if pd.api.types.is_integer_dtype(frame[name]):
+                frame[name] = frame[name].astype('Int64')
+            else:
+                # Python ints are kept as they are, converting them through float64 would round those above 2**53
+                values = frame[name]
+                exact = values.map(lambda value: isinstance(value, int) and not isinstance(value, bool) and -2 ** 63 <= value < 2 ** 63).astype(bool)
+                numbers = pd.to_numeric(values.mask(exact), errors='coerce')
+                # Only whole numbers are integers; fractions, infinities and numbers beyond BIGINT become nulls
+                numbers = numbers.where((numbers.round() == numbers) & (numbers.abs() < 2 ** 63)).astype('Int64')
+                numbers[exact] = pd.array(values[exact].tolist(), dtype='Int64')
+                frame[name] = numbers
+        elif column_type in ('Float', 'Decimal'):
+            frame[name] = pd.to_numeric(frame[name], errors='coerce').astype('float64')
+        elif column_type == 'DateTime':
+            # Parquet and datetime hold microseconds, the API sends up to 7 fractional digits
+            frame[name] = pd.to_datetime(frame[name], errors='coerce', utc=True, format='ISO8601').dt.tz_localize(None).dt.floor('us')
+        elif column_type == 'Boolean':
+            if pd.api.types.is_bool_dtype(frame[name]):
+                frame[name] = frame[name].astype('boolean')
+            else:
+                frame[name] = frame[name].map(coerce_boolean).astype('boolean')
+        else:
+            # NaN stands for a missing value here, not for the text 'NaN'
+            frame[name] = frame[name].map(
+                lambda value: value if value is None or isinstance(value, str)
+                else None if isinstance(value, float) and value != value
+                else json.dumps(value, ensure_ascii=False)
+            ).astype('string')
+
+    return frame
+
+
+
+def coerce_rows(rows, list_columns):
+    """
+    Converts a batch of rows to the types declared in a table schema, as driver-native values.
+
+    The batch is converted column by column (see `coerce_columns`), so DateTime strings, numbers
+    and booleans reach the database driver as datetime, int, float and bool values and nulls as None.
+
+    Args:
+        rows (list): The rows (tuples in column order).
+        list_columns (list): The schema of the table in the form of a list of dictionaries.
+
+    Returns:
+        list: The converted rows as tuples.
+    """
+    import pandas as pd
+
+    if not rows:
+        return []
+
+    column_names = [column['name'] for column in list_columns]
+    frame = coerce_columns(pd.DataFrame(rows, columns=column_names, dtype=object), list_columns)
+
+    # Object columns hold Python values, with None for every kind of missing value
+    values = []
+    for column in list_columns:
+        series = frame[column['name']]
+        if column['type'] == 'DateTime':
+            series = pd.Series(series.dt.to_pydatetime(), index=series.index, dtype=object)
+        values.append(series.astype(object).where(frame[column['name']].notna(), None).tolist())
+
+    return list(zip(*values))
+
+
+
+def get_arrow_schema(list_columns):
+    """
+    Returns the Arrow schema for a table schema.
+
+    Args:
+        list_columns (list): The schema of the table in the form of a list of dictionaries.
+
+    Returns:
+        pyarrow.Schema: The Arrow schema.
+    """
+    # Define a dictionary to map the string types in your schema to Arrow types
+    type_mapping = {
+        'Integer': pyarrow.int64(),
+        'String': pyarrow.string(),
+        'Float': pyarrow.float64(),
+        'DateTime': pyarrow.timestamp('us'),
+        'Text': pyarrow.string(),
+        'Boolean': pyarrow.bool_(),
+        'Decimal': pyarrow.float64()
+    }
+
+    return pyarrow.schema([(column['name'], type_mapping[column['type']]) for column in list_columns])
+
+
+
+def write_parquet_azure_storage(transformed_data, container_name, blob_name, list_columns, batch_size=None):
+    """
+    Writes rows to Azure Storage Blob as a typed Parquet file.
+
+    Rows are converted to the schema types in batches (see `coerce_columns`), and each
+    batch becomes one row group, so only one batch is held in memory besides the file.
+
+    Args:
+        transformed_data (iterable): The rows (tuples in column order) to write.
+        container_name (str): The name of the Azure Storage container.
+        blob_name (str): The name of the Parquet blob.
+        list_columns (list): The schema of the table in the form of a list of dictionaries.
+        batch_size (int, optional): The number of rows per row group. Defaults to SQL_BATCH_SIZE.
+
+    Returns:
+        int: The number of rows written.
+    """
+    import pandas as pd
+
+    if pyarrow is None:
+        raise ImportError("The pyarrow package is required to write Parquet files")
+
+    batch_size = batch_size or sql_batch_size
+    column_names = [column['name'] for column in list_columns]
+    arrow_schema = get_arrow_schema(list_columns)
+
+    total_rows = 0
+    with tempfile.SpooledTemporaryFile(max_size=parquet_spool_size) as parquet_file:
+        with pyarrow.parquet.ParquetWriter(parquet_file, arrow_schema, compression='zstd') as writer:
+            for batch in iter_batches(transformed_data, batch_size):
+                frame = coerce_columns(pd.DataFrame(batch, columns=column_names, dtype=object), list_columns)
+                writer.write_table(pyarrow.Table.from_pandas(frame, schema=arrow_schema, preserve_index=False))
+                total_rows += len(batch)
+
+        metrics.incr('blob.upload.bytes', parquet_file.tell())
+        parquet_file.seek(0)
+        blob_client = get_container_client(container_name).get_blob_client(blob_name)
+        with metrics.timer('blob.upload.duration'):
+            blob_client.upload_blob(parquet_file, overwrite=True)
+        metrics.incr('blob.uploads')
+
+    print(f"Upload Successful: {total_rows} rows to {container_name}/{blob_name}")
+    return total_rows
+
+
+
+def iter_rows_parquet_azure_storage(container_name, blob_name, list_columns, batch_size=None):
+    """
+    Reads rows of the given columns from a Parquet blob.
+
+    Only the requested columns are decoded, one batch at a time.
+
+    Args:
+        container_name (str): The name of the Azure Storage container.
+        blob_name (str): The name of the Parquet blob.
+        list_columns (list): The columns to read in the form of a list of dictionaries.
+        batch_size (int, optional): The number of rows decoded at a time. Defaults to SQL_BATCH_SIZE.
+
+    Yields:
+        tuple: The values of a row in column order.
+    """
+    if pyarrow is None:
+        raise ImportError("The pyarrow package is required to read Parquet files")
+
+    batch_size = batch_size or sql_batch_size
+    column_names = [column['name'] for column in list_columns]
+
+    with tempfile.SpooledTemporaryFile(max_size=parquet_spool_size) as parquet_file:
+        blob_client = get_container_client(container_name).get_blob_client(blob_name)
+        with metrics.timer('blob.download.duration'):
+            blob_client.download_blob().readinto(parquet_file)
+        metrics.incr('blob.downloads')
+        metrics.incr('blob.download.bytes', parquet_file.tell())
+        parquet_file.seek(0)
+
+        for record_batch in pyarrow.parquet.ParquetFile(parquet_file).iter_batches(batch_size=batch_size, columns=column_names):
+            yield from zip(*(record_batch.column(name).to_pylist() for name in column_names))
+
+
+
 def create_azure_engine():
     """
     Create and return an Azure SQL database engine.
@@ -132,31 +1135,64 @@ def create_azure_engine():
         sqlalchemy.engine.Engine: The created Azure SQL database engine.
     """
     params = urllib.parse.quote_plus(
-        f'Driver={driver};Server=tcp:{server},1433;Database={database};Uid={sql_username};Pwd={sql_password};Encrypt=yes;TrustServerCertificate=no;Connection Timeout=30;'
+        f'Driver={driver};Server=tcp:{server},1433;Database={database};Uid={sql_username};Pwd={get_sql_password()};Encrypt=yes;TrustServerCertificate=no;Connection Timeout=30;'
     )
     sql_conn_str = 'mssql+pyodbc:///?odbc_connect={}'.format(params)
-    engine_azure = create_engine(sql_conn_str, echo=True)
+    # fast_executemany sends each batch of parameters to the server in a single round-trip
+    engine_azure = create_engine(
+        sql_conn_str,
+        echo=sql_echo,
+        fast_executemany=True,
+        pool_size=sql_pool_size,
+        max_overflow=sql_max_overflow,
+        pool_pre_ping=True,
+        pool_recycle=sql_pool_recycle,
+    )
 
     return engine_azure
 
 
 
-def write_data_azure_sql(transformed_data, table_name, list_columns):
+def get_azure_engine():
     """
-    Loads transformed data into an Azure SQL database table.
+    Returns the Azure SQL database engine shared by the current process.
+
+    The engine (and its connection pool) is created on first use and reused by every
+    subsequent load. A process forked after the engine was created gets its own engine
+    so that pooled connections are never shared across processes.
+
+    Returns:
+        sqlalchemy.engine.Engine: The shared Azure SQL database engine.
+    """
+    global _engine, _engine_pid
+
+    pid = os.getpid()
+    if _engine is None or _engine_pid != pid:
+        with _engine_lock:
+            if _engine is None or _engine_pid != pid:
+                if _engine is not None:
+                    # Drop the parent's pooled connections without closing them underneath it
+                    _engine.dispose(close=False)
+                    with _table_registry_lock:
+                        _table_registry.clear()
+                _engine = create_azure_engine()
+                _engine_pid = pid
+
+    return _engine
+
+
+
+def build_table(table_name, list_columns):
+    """
+    Builds the SQLAlchemy table definition for a schema table.
 
     Args:
-        transformed_data (list): The transformed data to be loaded into the table.
-        server (str): The name of the Azure SQL server.
-        database (str): The name of the Azure SQL database.
-        username (str): The username for connecting to the Azure SQL server.
-        password (str): The password for connecting to the Azure SQL server.
-        table_schema (list): The schema of the table in the form of a list of dictionaries.
+        table_name (str): The name of the table.
+        list_columns (list): The schema of the table in the form of a list of dictionaries.
 
     Returns:
-        None
+        sqlalchemy.Table: The table definition, bound to its own MetaData.
     """
-    engine_azure = create_azure_engine() #old version create_engine(f'mssql+pyodbc://{sql_username}:{sql_password}@{server}/{database}?driver=ODBC+Driver+17+for+SQL+Server')
     metadata = MetaData()
 
     # Define a dictionary to map the string types in your schema to SQLAlchemy types
@@ -179,23 +1215,246 @@ def write_data_azure_sql(transformed_data, table_name, list_columns):
         else:
             columns.append(Column(column['name'], column_type))
 
-    # Create the table
-    table = Table(table_name, metadata, *columns)
+    return Table(table_name, metadata, *columns)
 
-    # Create the table if it doesn't exist
-    inspector = inspect(engine_azure)
-    if not inspector.has_table(table_name):
-        table.create(engine_azure)
 
-    # Create session
-    Session = sessionmaker(bind=engine_azure)
-    session = Session()
-    
-    # Insert data
+
+def get_table(engine_azure, table_name, list_columns):
+    """
+    Returns the SQLAlchemy table for a schema table, creating it in the database if needed.
+
+    Tables are memoized per process by name and column definitions, so the existence
+    check and DDL only run on the first load into a table.
+
+    Args:
+        engine_azure (sqlalchemy.engine.Engine): The Azure SQL database engine.
+        table_name (str): The name of the table.
+        list_columns (list): The schema of the table in the form of a list of dictionaries.
+
+    Returns:
+        sqlalchemy.Table: The table definition.
+    """
+    key = (table_name, tuple((column['name'], column['type'], column.get('length')) for column in list_columns))
+
+    with _table_registry_lock:
+        table = _table_registry.get(key)
+        if table is not None:
+            return table
+
+        # Create the table
+        table = build_table(table_name, list_columns)
+
+        # Create the table if it doesn't exist
+        table.create(engine_azure, checkfirst=True)
+
+        _table_registry[key] = table
+        return table
+
+
+
+def get_insert_statement(engine_azure, table_name, column_names):
+    """
+    Returns the driver-level INSERT statement for a table, with one positional parameter per column.
+
+    Args:
+        engine_azure (sqlalchemy.engine.Engine): The Azure SQL database engine.
+        table_name (str): The name of the table.
+        column_names (list): The column names, in row order.
+
+    Returns:
+        str: The INSERT statement.
+    """
+    quote = engine_azure.dialect.identifier_preparer.quote
+    return (f'INSERT INTO {quote(table_name)} ({", ".join(quote(name) for name in column_names)}) '
+            f'VALUES ({", ".join("?" for _ in column_names)})')
+
+
+
+def iter_batches(rows, batch_size):
+    """
+    Splits an iterable of rows into lists of at most `batch_size` rows.
+
+    Args:
+        rows (iterable): The rows to split.
+        batch_size (int): The maximum number of rows per batch.
+
+    Yields:
+        list: The next batch of rows.
+    """
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+
+def write_data_azure_sql(transformed_data, table_name, list_columns, batch_size=None):
+    """
+    Loads transformed data into an Azure SQL database table.
+
+    Rows are inserted in batches of `batch_size` with a single executemany call per batch
+    (using pyodbc fast_executemany), and each batch is committed in its own transaction.
+    Each batch is converted to the schema types first (see `coerce_rows`) and passed to the
+    driver as tuples, without per-row processing by SQLAlchemy.
+
+    Args:
+        transformed_data (iterable): The transformed rows (tuples in column order) to be loaded into the table.
+        table_name (str): The name of the table to load.
+        list_columns (list): The schema of the table in the form of a list of dictionaries.
+        batch_size (int, optional): The number of rows per batch. Defaults to SQL_BATCH_SIZE.
+
+    Returns:
+        int: The number of rows loaded.
+    """
+    engine_azure = get_azure_engine()
+    table = get_table(engine_azure, table_name, list_columns)
+
+    # Insert data, one transaction per batch
+    batch_size = batch_size or sql_batch_size
+    insert_statement = get_insert_statement(engine_azure, table_name, table.columns.keys())
+
+    total_rows = 0
+    batch_count = 0
+    start_time = time.perf_counter()
+
+    for batch in iter_batches(transformed_data, batch_size):
+        batch = coerce_rows(batch, list_columns)
+        with metrics.timer('sql.batch.duration'), engine_azure.begin() as connection:
+            connection.exec_driver_sql(insert_statement, batch)
+        total_rows += len(batch)
+        batch_count += 1
+        metrics.incr('sql.rows', len(batch))
+        metrics.incr('sql.batches')
+
+    elapsed = time.perf_counter() - start_time
+    metrics.timing('sql.write.duration', elapsed * 1000)
+    rows_per_second = total_rows / elapsed if elapsed > 0 else 0
+    print(f"Loaded {total_rows} rows into {table_name} in {batch_count} batches of up to {batch_size} "
+          f"({elapsed:.1f}s, {rows_per_second:.0f} rows/sec)")
+
+    return total_rows
+
+
+
+def merge_data_azure_sql(transformed_data, table_name, list_columns, merge_key, parent_key=None, deleted_ids=None, batch_size=None, reloaded_ids=None):
+    """
+    Upserts transformed data into an Azure SQL database table.
+
+    The rows are bulk loaded into a session temp table in batches (as in
+    `write_data_azure_sql`) and applied to the target table with a single set-based MERGE
+    on `merge_key`, so reloading changed objects updates their rows instead of adding
+    duplicates. When `parent_key` is given, target rows of the reloaded parents that are no
+    longer in the data (e.g. an Office removed from an Opportunity) are deleted as well,
+    including all rows of reloaded parents that have no rows left (an empty array).
+    Finally, rows of deleted objects are removed by `parent_key` (or by `merge_key` when it
+    is a single column).
+
+    Args:
+        transformed_data (iterable): The transformed rows (tuples in column order) to be merged into the table.
+        table_name (str): The name of the table to load.
+        list_columns (list): The schema of the table in the form of a list of dictionaries.
+        merge_key (str | list): The column(s) identifying a row.
+        parent_key (str, optional): The column holding the ID of the object a row belongs to.
+        deleted_ids (list, optional): The IDs of objects deleted in Cosential.
+        batch_size (int, optional): The number of rows per staging batch. Defaults to SQL_BATCH_SIZE.
+        reloaded_ids (list, optional): The IDs of the objects reloaded in this run. With
+            `parent_key`, the rows of those without staged rows are deleted.
+
+    Returns:
+        int: The number of rows staged for the merge.
+
+    Raises:
+        ValueError: If there are deleted objects but no column to find their rows by.
+    """
+    merge_key = [merge_key] if isinstance(merge_key, str) else list(merge_key)
+    delete_key = parent_key or (merge_key[0] if len(merge_key) == 1 else None)
+    batch_size = batch_size or sql_batch_size
+
+    if deleted_ids and delete_key is None:
+        raise ValueError(f"{table_name} has a composite merge_key and no parent_key, so the rows of "
+                         f"{len(deleted_ids)} deleted objects cannot be removed; set parent_key in the table schema")
+
+    engine_azure = get_azure_engine()
+    table = get_table(engine_azure, table_name, list_columns)
+
+    quote = engine_azure.dialect.identifier_preparer.quote
+    column_names = table.columns.keys()
+    target = quote(table_name)
+    staging_name = f'#stage_{table_name}'
+    staging = quote(staging_name)
+
+    all_columns = ', '.join(quote(name) for name in column_names)
+    key_match = ' AND '.join(f'target.{quote(name)} = source.{quote(name)}' for name in merge_key)
+    key_not_null = ' AND '.join(f'{quote(name)} IS NOT NULL' for name in merge_key)
+    updates = ', '.join(f'target.{quote(name)} = source.{quote(name)}' for name in column_names if name not in merge_key)
+
+    # Keep one staged row per key, since MERGE rejects updating the same target row twice
+    merge_statement = (
+        f'MERGE INTO {target} WITH (HOLDLOCK) AS target '
+        f'USING (SELECT {all_columns} FROM ('
+        f'SELECT *, ROW_NUMBER() OVER (PARTITION BY {", ".join(quote(name) for name in merge_key)} ORDER BY (SELECT NULL)) AS staged_row '
+        f'FROM {staging} WHERE {key_not_null}) AS staged WHERE staged_row = 1) AS source '
+        f'ON {key_match} '
+        + (f'WHEN MATCHED THEN UPDATE SET {updates} ' if updates else '')
+        + f'WHEN NOT MATCHED BY TARGET THEN INSERT ({all_columns}) '
+        f'VALUES ({", ".join(f"source.{quote(name)}" for name in column_names)});'
+    )
+
+    total_rows = 0
+    start_time = time.perf_counter()
+
     with engine_azure.connect() as connection:
-        for row in transformed_data:
-            insert_query = table.insert().values(dict(zip(table.columns.keys(), row)))
-            connection.execute(insert_query)
-    
-    session.commit()
-    session.close()
+        with connection.begin():
+            connection.execute(text(f'DROP TABLE IF EXISTS {staging}'))
+            connection.execute(text(f'SELECT TOP 0 {all_columns} INTO {staging} FROM {target}'))
+
+        try:
+            # Stage the data, one executemany of converted rows per batch
+            insert_statement = get_insert_statement(engine_azure, staging_name, column_names)
+            for batch in iter_batches(transformed_data, batch_size):
+                batch = coerce_rows(batch, list_columns)
+                with metrics.timer('sql.batch.duration'), connection.begin():
+                    connection.exec_driver_sql(insert_statement, batch)
+                total_rows += len(batch)
+                metrics.incr('sql.rows', len(batch))
+                metrics.incr('sql.batches')
+
+            with metrics.timer('sql.merge.duration'), connection.begin():
+                if parent_key:
+                    connection.execute(text(
+                        f'DELETE target FROM {target} AS target '
+                        f'WHERE EXISTS (SELECT 1 FROM {staging} AS source WHERE source.{quote(parent_key)} = target.{quote(parent_key)}) '
+                        f'AND NOT EXISTS (SELECT 1 FROM {staging} AS source WHERE {key_match})'
+                    ))
+
+                    # Reloaded parents without staged rows have lost all of them
+                    if reloaded_ids:
+                        emptied_statement = text(
+                            f'DELETE target FROM {target} AS target WHERE target.{quote(parent_key)} IN :ids '
+                            f'AND NOT EXISTS (SELECT 1 FROM {staging} AS source WHERE source.{quote(parent_key)} = target.{quote(parent_key)})'
+                        ).bindparams(bindparam('ids', expanding=True))
+                        for ids in iter_batches(reloaded_ids, 1000):
+                            connection.execute(emptied_statement, {'ids': ids})
+
+                connection.execute(text(merge_statement))
+
+                if deleted_ids and delete_key:
+                    delete_statement = text(f'DELETE FROM {target} WHERE {quote(delete_key)} IN :ids').bindparams(
+                        bindparam('ids', expanding=True)
+                    )
+                    # Stay below the 2100 parameter limit of SQL Server
+                    for ids in iter_batches(deleted_ids, 1000):
+                        connection.execute(delete_statement, {'ids': ids})
+        finally:
+            with connection.begin():
+                connection.execute(text(f'DROP TABLE IF EXISTS {staging}'))
+
+    elapsed = time.perf_counter() - start_time
+    metrics.timing('sql.write.duration', elapsed * 1000)
+    rows_per_second = total_rows / elapsed if elapsed > 0 else 0
+    print(f"Merged {total_rows} rows into {table_name} on {', '.join(merge_key)} with {len(deleted_ids or [])} deleted objects "
+          f"({elapsed:.1f}s, {rows_per_second:.0f} rows/sec)")
+
+    return total_rows
\ No newline at end of file
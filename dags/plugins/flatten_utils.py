@@ -0,0 +1,175 @@
+import re
+
+from plugins import metrics
+
+# One step of a path: .name, ['name'], [*] or [index]
+_path_step = re.compile(r"\.([A-Za-z_][\w-]*)|\['([^']+)'\]|\[(\*)\]|\[(-?\d+)\]")
+
+_missing = object()
+
+
+def compile_path(path):
+    """
+    Compiles a JSONPath-style expression into a function that evaluates it.
+
+    Supported are the root `$` followed by any number of `.name`, `['name']`, `[*]` (every
+    item of a list) and `[index]` steps, e.g. `$.offices[*]` or `$.team['roles']`.
+
+    Args:
+        path (str): The expression.
+
+    Returns:
+        callable: A function from a value to a tuple (matches, found). `matches` lists the
+        values the path leads to. `found` is False when a name step was missing from every
+        value it was applied to, i.e. the data does not contain the path at all.
+
+    Raises:
+        ValueError: If the expression is not supported.
+    """
+    if not path.startswith('$'):
+        raise ValueError(f"Path must start with '$': {path}")
+
+    steps = []
+    position = 1
+    while position < len(path):
+        match = _path_step.match(path, position)
+        if match is None:
+            raise ValueError(f"Unsupported path step at position {position}: {path}")
+        name, quoted_name, wildcard, index = match.groups()
+        if wildcard:
+            steps.append(('wildcard', None))
+        elif index is not None:
+            steps.append(('index', int(index)))
+        else:
+            steps.append(('name', name or quoted_name))
+        position = match.end()
+
+    def evaluate(value):
+        nodes = [value]
+        for kind, argument in steps:
+            next_nodes = []
+            if kind == 'name':
+                for node in nodes:
+                    child = node.get(argument, _missing) if isinstance(node, dict) else _missing
+                    if child is not _missing:
+                        next_nodes.append(child)
+                if nodes and not next_nodes:
+                    return [], False
+            elif kind == 'wildcard':
+                for node in nodes:
+                    if isinstance(node, list):
+                        next_nodes.extend(node)
+                    elif isinstance(node, dict):
+                        next_nodes.extend(node.values())
+            else:
+                for node in nodes:
+                    if isinstance(node, list) and -len(node) <= argument < len(node):
+                        next_nodes.append(node[argument])
+            nodes = next_nodes
+        return nodes, True
+
+    return evaluate
+
+
+def compile_array_mapping(mapping):
+    """
+    Compiles the mapping of an array onto its parent records.
+
+    A mapping is either a path (e.g. `$.offices[*]`) or a dictionary with the `path` and
+    optional `fields`, mapping output field names to paths relative to each item
+    (e.g. `{"OfficeId": "$.office.id"}`). Without `fields`, items are taken as they are.
+
+    Args:
+        mapping (str | dict): The mapping from cosential_arrays.json.
+
+    Returns:
+        callable: A function from a parent record to its array items, or None when the record
+        does not contain the path (so the array must be requested from its endpoint).
+    """
+    if isinstance(mapping, str):
+        mapping = {'path': mapping}
+
+    evaluate = compile_path(mapping['path'])
+    fields = [(name, compile_path(field_path)) for name, field_path in (mapping.get('fields') or {}).items()]
+
+    def extract(record):
+        matches, found = evaluate(record)
+        if not found:
+            return None
+
+        # Like the array endpoint, an object is one item and a list holds the items (null means none)
+        items = []
+        for match in matches:
+            if isinstance(match, list):
+                items.extend(match)
+            elif match is not None:
+                items.append(match)
+
+        if fields:
+            items = [
+                {name: next(iter(evaluate_field(item)[0]), None) for name, evaluate_field in fields}
+                for item in items
+            ]
+        else:
+            items = [dict(item) if isinstance(item, dict) else item for item in items]
+        return items
+
+    return extract
+
+
+def get_array_mappings(entity_arrays, entity_name):
+    """
+    Returns the compiled mappings of an entity's arrays.
+
+    Mappings are declared per entity in cosential_arrays.json, next to its arrays, e.g.
+    `{"Entity": "Opportunities", "Arrays": ["Office"], "Mappings": {"Office": "$.offices[*]"}}`.
+    Arrays without a mapping are always requested from their endpoint.
+
+    Args:
+        entity_arrays (list): The contents of cosential_arrays.json.
+        entity_name (str): The name of the entity.
+
+    Returns:
+        dict: The compiled mapping (see `compile_array_mapping`) of each mapped array.
+    """
+    mappings = {}
+    for entity_array in entity_arrays:
+        if entity_array['Entity'] == entity_name:
+            for array_name, mapping in (entity_array.get('Mappings') or {}).items():
+                mappings[array_name] = compile_array_mapping(mapping)
+    return mappings
+
+
+def iter_flattened(parent_records, extract, missing_ids):
+    """
+    Derives the items of an array from the parent records that embed it, as the records arrive.
+
+    Args:
+        parent_records (iterable): (object_id, record) tuples of the pulled parent objects.
+        extract (callable): The compiled mapping of the array (see `compile_array_mapping`).
+        missing_ids (list): A list to which the IDs of the parents that do not embed the
+            array are appended.
+
+    Yields:
+        any: The items, with the parent object ID stamped on every item as `ObjectId`.
+    """
+    item_count = 0
+    missing_count = 0
+
+    try:
+        for object_id, record in parent_records:
+            record_items = extract(record)
+            if record_items is None:
+                missing_ids.append(object_id)
+                missing_count += 1
+                continue
+
+            for item in record_items:
+                if isinstance(item, dict):
+                    item['ObjectId'] = object_id
+                item_count += 1
+                yield item
+    finally:
+        metrics.incr('flatten.items', item_count)
+        metrics.incr('flatten.fallback_objects', missing_count)
+
@@ -0,0 +1,198 @@
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    from opentelemetry import metrics as otel_metrics
+except ImportError:  # OpenTelemetry export is optional
+    otel_metrics = None
+
+logger = logging.getLogger(__name__)
+
+# Where metrics are exported, besides the per-task summary: a comma separated list of 'statsd' and 'otel'
+metrics_exporters = {exporter.strip() for exporter in os.getenv('METRICS_EXPORTERS', '').split(',') if exporter.strip()}
+metrics_prefix = os.getenv('METRICS_PREFIX', 'cosential')
+statsd_host = os.getenv('METRICS_STATSD_HOST', 'localhost')
+statsd_port = int(os.getenv('METRICS_STATSD_PORT', '8125'))
+
+_totals = {}
+_totals_lock = threading.Lock()
+_statsd_socket = None
+_otel_instruments = {}
+
+
+def send_statsd(name, value, metric_type):
+    """
+    Sends one metric to StatsD over UDP. Errors are ignored, metrics must never fail a task.
+
+    Args:
+        name (str): The metric name, without the prefix.
+        value (float): The value.
+        metric_type (str): The StatsD type, `c` (counter) or `ms` (timer).
+    """
+    global _statsd_socket
+
+    try:
+        if _statsd_socket is None:
+            _statsd_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        payload = f'{metrics_prefix}.{name}:{value:g}|{metric_type}'.encode('UTF-8')
+        _statsd_socket.sendto(payload, (statsd_host, statsd_port))
+    except OSError:
+        pass
+
+
+def record_otel(name, value, metric_type):
+    """
+    Records one metric with the OpenTelemetry meter provider configured for the process.
+
+    Args:
+        name (str): The metric name, without the prefix.
+        value (float): The value.
+        metric_type (str): `c` (counter) or `ms` (histogram in milliseconds).
+    """
+    if otel_metrics is None:
+        return
+
+    instrument = _otel_instruments.get(name)
+    if instrument is None:
+        meter = otel_metrics.get_meter(metrics_prefix)
+        if metric_type == 'c':
+            instrument = meter.create_counter(f'{metrics_prefix}.{name}')
+        else:
+            instrument = meter.create_histogram(f'{metrics_prefix}.{name}', unit='ms')
+        _otel_instruments[name] = instrument
+
+    if metric_type == 'c':
+        instrument.add(value)
+    else:
+        instrument.record(value)
+
+
+def record(name, value, metric_type):
+    """
+    Adds a value to the in-process totals and sends it to the configured exporters.
+
+    Args:
+        name (str): The metric name, without the prefix.
+        value (float): The value.
+        metric_type (str): `c` (counter) or `ms` (timer).
+    """
+    with _totals_lock:
+        total = _totals.get(name)
+        if total is None:
+            total = _totals[name] = {'type': metric_type, 'count': 0, 'sum': 0.0, 'max': 0.0}
+        total['count'] += 1
+        total['sum'] += value
+        total['max'] = max(total['max'], value)
+
+    if 'statsd' in metrics_exporters:
+        send_statsd(name, value, metric_type)
+    if 'otel' in metrics_exporters:
+        record_otel(name, value, metric_type)
+
+
+def incr(name, value=1):
+    """
+    Increments a counter.
+
+    Args:
+        name (str): The metric name, e.g. `api.requests`.
+        value (int, optional): The increment.
+    """
+    record(name, value, 'c')
+
+
+def timing(name, milliseconds):
+    """
+    Records a duration.
+
+    Args:
+        name (str): The metric name, e.g. `api.latency`.
+        milliseconds (float): The duration in milliseconds.
+    """
+    record(name, milliseconds, 'ms')
+
+
+@contextmanager
+def timer(name):
+    """
+    Times the enclosed block, also when it raises.
+
+    Args:
+        name (str): The metric name.
+    """
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        timing(name, (time.monotonic() - started) * 1000)
+
+
+def iter_counted(chunks, name):
+    """
+    Passes chunks of bytes or text through, counting their size.
+
+    Args:
+        chunks (iterable): The chunks.
+        name (str): The counter, e.g. `blob.download.bytes`.
+
+    Yields:
+        bytes | str: The chunks, unchanged.
+    """
+    size = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+    finally:
+        incr(name, size)
+
+
+def reset(context=None):
+    """
+    Clears the in-process totals. Usable as an Airflow callback at the start of a task.
+
+    Args:
+        context (dict, optional): The Airflow task context.
+    """
+    with _totals_lock:
+        _totals.clear()
+
+
+def summarize():
+    """
+    Returns the in-process totals.
+
+    Returns:
+        dict: For every metric, its type, count, sum and max.
+    """
+    with _totals_lock:
+        return {name: dict(total) for name, total in _totals.items()}
+
+
+def log_summary(context=None):
+    """
+    Logs one line per metric recorded since the last reset. Usable as an Airflow task callback.
+
+    Args:
+        context (dict, optional): The Airflow task context.
+    """
+    totals = summarize()
+    task_id = context['task_instance'].task_id if context and 'task_instance' in context else 'task'
+
+    if not totals:
+        logger.info(f"No metrics recorded for {task_id}")
+        return
+
+    lines = []
+    for name, total in sorted(totals.items()):
+        if total['type'] == 'ms':
+            lines.append(f"  {name}: {total['count']} timed, {total['sum'] / 1000:.2f}s total, "
+                         f"{total['sum'] / total['count']:.1f}ms avg, {total['max']:.1f}ms max")
+        else:
+            lines.append(f"  {name}: {total['sum']:g}")
+    logger.info(f"Metrics for {task_id}:\n" + '\n'.join(lines))
+
@@ -0,0 +1,95 @@
+import functools
+import json
+import operator
+
+
+class TablePlan:
+    """
+    A schema table compiled for projecting landed records into rows.
+
+    The column names, keys and row extractor are computed once per table instead of per
+    row, and `extract` picks a record's values with a C-level itemgetter.
+    """
+
+    def __init__(self, table_dict):
+        self.table_dict = table_dict
+        self.table_name = table_dict['table_name']
+        self.file_name = table_dict['file_name']
+        self.columns = table_dict['columns']
+        self.column_names = tuple(column['name'] for column in self.columns)
+        self.merge_key = table_dict.get('merge_key')
+        self.parent_key = table_dict.get('parent_key')
+        self.extract = compile_row_extractor(self.column_names)
+
+    def iter_rows(self, records):
+        """
+        Projects records onto the table's columns.
+
+        Args:
+            records (iterable): The landed records (dictionaries).
+
+        Yields:
+            tuple: The values of a record in column order, None for missing fields.
+        """
+        return map(self.extract, records)
+
+
+def compile_row_extractor(column_names):
+    """
+    Returns a function that picks the values of the given columns from a record.
+
+    Records holding every column are read with a single itemgetter call. Records missing
+    a column fall back to `dict.get`, so missing fields become None.
+
+    Args:
+        column_names (tuple): The column names, in column order.
+
+    Returns:
+        callable: A function from a record (dict) to a tuple of its values.
+    """
+    getter = operator.itemgetter(*column_names)
+    single_column = len(column_names) == 1
+
+    def extract(record):
+        try:
+            values = getter(record)
+        except KeyError:
+            return tuple(map(record.get, column_names))
+        return (values,) if single_column else values
+
+    return extract
+
+
+@functools.lru_cache(maxsize=8)
+def compile_schema(schema_json):
+    """
+    Compiles Cosential_Table_Schemas.json into table plans indexed by entity.
+
+    Args:
+        schema_json (str): The schema, serialized with sorted keys.
+
+    Returns:
+        dict: The TablePlans of each entity, in schema order.
+    """
+    schema = json.loads(schema_json)
+    return {
+        entity_dict['Entity']: tuple(TablePlan(table_dict) for table_dict in entity_dict['tables'])
+        for entity_dict in schema['Entities']
+    }
+
+
+def get_table_plans(schema, entity_name):
+    """
+    Returns the compiled table plans of an entity.
+
+    Plans are cached per process and schema content, so tasks receiving the same schema
+    compile it once.
+
+    Args:
+        schema (dict): The contents of Cosential_Table_Schemas.json.
+        entity_name (str): The name of the entity.
+
+    Returns:
+        tuple: The TablePlans of the entity's tables (empty if the entity has none).
+    """
+    return compile_schema(json.dumps(schema, sort_keys=True)).get(entity_name, ())
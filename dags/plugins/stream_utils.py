@@ -0,0 +1,118 @@
+import os
+import queue
+import threading
+
+# Items buffered between a producer thread and each of its consumers
+pipeline_queue_size = int(os.getenv('PIPELINE_QUEUE_SIZE', '1000'))
+
+
+def iter_prefetched(iterable, max_items=None):
+    """
+    Consumes an iterable in a background thread, keeping up to `max_items` items ready.
+
+    This lets a download and parse (the producer) overlap with the work done on each
+    item (the consumer). Exceptions raised by the producer are re-raised to the consumer.
+
+    Args:
+        iterable (iterable): The items to produce.
+        max_items (int, optional): The size of the bounded queue. Defaults to PIPELINE_QUEUE_SIZE.
+
+    Yields:
+        any: The items of `iterable`, in order.
+    """
+    stream = iter_fanout(iterable, 1, max_items)[0]
+    try:
+        yield from stream
+    finally:
+        stream.close()
+
+
+class FanoutStream:
+    """
+    One consumer's iterator over the items of `iter_fanout`.
+
+    Closing the stream before it is exhausted (also before it was started) stops the producer.
+    """
+
+    def __init__(self, items, done, errors, stopped):
+        self.items = items
+        self.done = done
+        self.errors = errors
+        self.stopped = stopped
+        self.finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.finished:
+            raise StopIteration
+        while True:
+            try:
+                item = self.items.get(timeout=1)
+                break
+            except queue.Empty:
+                if self.stopped.is_set():
+                    self.finished = True
+                    raise RuntimeError("Another consumer of the stream stopped early")
+        if item is self.done:
+            self.finished = True
+            if self.errors:
+                raise self.errors[0]
+            raise StopIteration
+        return item
+
+    def close(self):
+        if not self.finished:
+            self.finished = True
+            self.stopped.set()
+
+
+def iter_fanout(iterable, count, max_items=None):
+    """
+    Consumes an iterable in a background thread and hands every item to `count` consumers.
+
+    Each consumer reads its own bounded queue, so consumers running in different threads
+    (e.g. the uploads of an object and of the arrays derived from it) proceed concurrently,
+    and the producer is held back by the slowest one. Exceptions raised by the producer are
+    re-raised to every consumer. When a consumer is closed early, the producer stops and the
+    other consumers raise, since they would miss items otherwise.
+
+    Args:
+        iterable (iterable): The items to produce.
+        count (int): The number of consumers.
+        max_items (int, optional): The size of each bounded queue. Defaults to PIPELINE_QUEUE_SIZE.
+
+    Returns:
+        list: One FanoutStream per consumer, each yielding the items of `iterable` in order.
+    """
+    queues = [queue.Queue(maxsize=max_items or pipeline_queue_size) for _ in range(count)]
+    done = object()
+    errors = []
+    stopped = threading.Event()
+
+    def put(items, item):
+        # Give up once a consumer has stopped, so an abandoned producer never blocks forever
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                for items in queues:
+                    if not put(items, item):
+                        return
+        except Exception as e:
+            errors.append(e)
+        for items in queues:
+            put(items, done)
+
+    producer = threading.Thread(target=produce, name='fanout', daemon=True)
+    producer.start()
+
+    return [FanoutStream(items, done, errors, stopped) for items in queues]
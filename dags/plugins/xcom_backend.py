@@ -0,0 +1,122 @@
+import functools
+import gzip
+import json
+import os
+
+from airflow.models.xcom import BaseXCom
+from airflow.utils.json import XComDecoder, XComEncoder
+
+from plugins.azure_utils import get_container_client
+
+# Values larger than this many bytes (serialized) are stored outside the metadata DB
+xcom_reference_threshold = int(os.getenv('XCOM_REFERENCE_THRESHOLD', str(64 * 1024)))
+# Where large values are stored: 'blob' (BLOB_CONTAINER) or 'local' (XCOM_LOCAL_PATH, must be shared by all workers)
+xcom_storage = os.getenv('XCOM_STORAGE', 'blob')
+xcom_local_path = os.getenv('XCOM_LOCAL_PATH', '/tmp/xcom')
+xcom_blob_prefix = 'xcom'
+xcom_cache_size = int(os.getenv('XCOM_CACHE_SIZE', '32'))
+
+REFERENCE_PREFIX = 'xcom-ref://'
+
+
+def get_reference_path(dag_id, run_id, task_id, key, map_index):
+    """
+    Returns the storage path of a stored XCom value.
+
+    Args:
+        dag_id (str): The DAG ID.
+        run_id (str): The DAG run ID.
+        task_id (str): The task ID.
+        key (str): The XCom key.
+        map_index (int): The map index of the task instance (-1 when not mapped).
+
+    Returns:
+        str: The path of the value, relative to the storage root.
+    """
+    run_id = run_id.replace(':', '_').replace('+', '_')
+    suffix = f'_{map_index}' if map_index is not None and map_index >= 0 else ''
+    return f'{xcom_blob_prefix}/{dag_id}/{run_id}/{task_id}/{key}{suffix}.json.gz'
+
+
+def store_payload(path, payload):
+    """
+    Stores a serialized XCom value, gzip compressed.
+
+    Args:
+        path (str): The path of the value (see `get_reference_path`).
+        payload (bytes): The JSON serialized value.
+
+    Returns:
+        None
+    """
+    data = gzip.compress(payload)
+
+    if xcom_storage == 'local':
+        local_path = os.path.join(xcom_local_path, path)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        with open(local_path, 'wb') as f:
+            f.write(data)
+    else:
+        blob_client = get_container_client(os.environ['BLOB_CONTAINER']).get_blob_client(path)
+        blob_client.upload_blob(data, overwrite=True)
+
+
+@functools.lru_cache(maxsize=xcom_cache_size)
+def load_payload(reference):
+    """
+    Loads and deserializes a stored XCom value.
+
+    Results are cached per process, so pulling the same value repeatedly within a task
+    downloads it once. Callers must treat the returned value as read-only.
+
+    Args:
+        reference (str): The reference pushed in place of the value.
+
+    Returns:
+        any: The deserialized value.
+    """
+    storage, path = reference[len(REFERENCE_PREFIX):].split('/', 1)
+
+    if storage == 'local':
+        with open(os.path.join(xcom_local_path, path), 'rb') as f:
+            data = f.read()
+    else:
+        blob_client = get_container_client(os.environ['BLOB_CONTAINER']).get_blob_client(path)
+        data = blob_client.download_blob().readall()
+
+    return json.loads(gzip.decompress(data).decode('UTF-8'), cls=XComDecoder)
+
+
+class ReferenceXComBackend(BaseXCom):
+    """
+    XCom backend that keeps large values out of the Airflow metadata database.
+
+    Values whose JSON serialization exceeds XCOM_REFERENCE_THRESHOLD bytes are written
+    to blob storage (or a shared local path) and only a small `xcom-ref://` reference is
+    stored in the database. Smaller values are stored as usual.
+
+    Enable it with AIRFLOW__CORE__XCOM_BACKEND=plugins.xcom_backend.ReferenceXComBackend.
+    """
+
+    @staticmethod
+    def serialize_value(value, *, key=None, task_id=None, dag_id=None, run_id=None, map_index=None):
+        payload = json.dumps(value, cls=XComEncoder).encode('UTF-8')
+
+        if len(payload) <= xcom_reference_threshold or None in (key, task_id, dag_id, run_id):
+            return BaseXCom.serialize_value(value)
+
+        path = get_reference_path(dag_id, run_id, task_id, key, map_index)
+        store_payload(path, payload)
+        return BaseXCom.serialize_value(f'{REFERENCE_PREFIX}{xcom_storage}/{path}')
+
+    @staticmethod
+    def deserialize_value(result):
+        value = BaseXCom.deserialize_value(result)
+
+        if isinstance(value, str) and value.startswith(REFERENCE_PREFIX):
+            return load_payload(value)
+        return value
+
+    def orm_deserialize_value(self):
+        # Show the reference in the webserver instead of downloading the value
+        return BaseXCom._deserialize_value(self, True)
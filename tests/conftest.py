@@ -0,0 +1,6 @@
+"""Makes the DAG modules and the `plugins` package importable the way the DAGs import them, from the dags folder."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dags'))
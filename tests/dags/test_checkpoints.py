@@ -0,0 +1,52 @@
+"""Tests of the checkpoint resume rules of process_entity. No storage account is used."""
+
+import pytest
+
+import CosentialDAG
+
+ENTITY = {'Entity': 'Opportunities', 'Endpoint': 'opportunities'}
+IDS = list(range(1, 1201))
+
+
+@pytest.fixture
+def stored(monkeypatch):
+    """The checkpoint read from storage, if any."""
+    checkpoints = {}
+    monkeypatch.setattr(CosentialDAG, 'read_from_azure_storage', lambda container, blob_name: checkpoints.get('shard', False))
+    return checkpoints
+
+
+def landed(run_id='run-1', ids=IDS, chunk_size=500, chunks=('0', '1')):
+    checkpoint = CosentialDAG.load_checkpoint(ENTITY, 'year=2024', 0, run_id, ids, chunk_size)
+    checkpoint['chunks'] = {chunk: {'objects': chunk_size, 'failed_ids': []} for chunk in chunks}
+    return checkpoint
+
+
+def test_new_checkpoint_splits_the_ids_into_chunks(stored):
+    checkpoint = CosentialDAG.load_checkpoint(ENTITY, 'year=2024', 0, 'run-1', IDS, 500)
+
+    assert checkpoint['chunk_count'] == 3
+    assert checkpoint['chunks'] == {}
+
+
+def test_empty_shard_has_one_chunk(stored):
+    assert CosentialDAG.load_checkpoint(ENTITY, 'year=2024', 0, 'run-1', [], 500)['chunk_count'] == 1
+
+
+def test_retry_of_the_same_run_resumes(stored):
+    stored['shard'] = landed()
+
+    checkpoint = CosentialDAG.load_checkpoint(ENTITY, 'year=2024', 0, 'run-1', IDS, 500)
+
+    assert set(checkpoint['chunks']) == {'0', '1'}
+
+
+@pytest.mark.parametrize('run_id, ids, chunk_size', [
+    ('run-2', IDS, 500),
+    ('run-1', IDS[:-1], 500),
+    ('run-1', IDS, 400),
+])
+def test_other_runs_ids_or_chunk_sizes_start_over(stored, run_id, ids, chunk_size):
+    stored['shard'] = landed()
+
+    assert CosentialDAG.load_checkpoint(ENTITY, 'year=2024', 0, run_id, ids, chunk_size)['chunks'] == {}
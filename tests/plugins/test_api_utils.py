@@ -0,0 +1,259 @@
+"""Unit tests for the pure helpers of plugins/api_utils.py. No requests are made."""
+
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+import requests
+
+from plugins import api_utils
+from plugins.api_utils import ChangeSet, PageSizer, fetch_concurrently, get_retry_delay, iter_entity_arrays, iter_entity_objects, request_with_retry
+
+
+def drive(sizer, rate_of_size, pages):
+    """Feeds `pages` pages to a sizer, with the throughput given by `rate_of_size`, and returns the sizes used."""
+    sizes = []
+    for _ in range(pages):
+        size = sizer.size
+        sizes.append(size)
+        sizer.observe(size, rate_of_size(size), 1.0)
+    return sizes
+
+
+def test_page_sizer_holds_the_maximum_when_throughput_rises_with_size():
+    sizer = PageSizer(500, 100, 500)
+    sizes = drive(sizer, lambda size: size * 1000, 200)
+
+    # Only the occasional probe leaves the maximum
+    assert sizes[:5] == [500] * 5
+    assert sizes.count(500) >= 0.9 * len(sizes)
+    assert set(sizes) <= {500, 350}
+
+
+def test_page_sizer_holds_the_minimum_when_throughput_falls_with_size():
+    sizer = PageSizer(500, 100, 500)
+    sizes = drive(sizer, lambda size: 1_000_000 // size, 200)
+
+    assert sizes[-50:].count(100) >= 45
+
+
+def test_page_sizer_settles_around_an_interior_optimum():
+    sizer = PageSizer(500, 100, 1000)
+    sizes = drive(sizer, lambda size: 1_000_000 - (size - 250) ** 2, 300)
+
+    assert sizes[-100:].count(250) >= 85
+
+
+def test_page_sizer_rounds_sizes_to_stable_values():
+    sizer = PageSizer(500, 100, 500)
+    sizes = drive(sizer, lambda size: 1_000_000 // size, 50)
+
+    assert all(size % PageSizer.granularity == 0 for size in sizes)
+
+
+def test_page_sizer_ignores_pages_of_an_earlier_size():
+    sizer = PageSizer(500, 100, 500)
+    sizer.observe(300, 1, 1.0)
+
+    assert sizer.size == 500
+
+
+def test_change_set_keeps_the_latest_change_per_object():
+    change_set = ChangeSet('Opportunities', base_version=10)
+    # Newest first, as the feed is read with reverse=true
+    change_set.add(3, 30, is_deleted=True)
+    change_set.add(1, 20)
+    change_set.add(3, 15)
+    change_set.add(2, 12)
+    change_set.add(1, 11, is_deleted=True)
+
+    assert change_set.change_count == 5
+    assert len(change_set) == 3
+    assert change_set.upserts == [1, 2]
+    assert change_set.deletes == [3]
+    assert change_set.latest_version == 30
+
+
+def test_change_set_replaces_a_change_with_a_newer_version():
+    change_set = ChangeSet('Opportunities')
+    change_set.add(1, 5, is_deleted=True)
+    change_set.add(1, 7)
+
+    assert change_set.upserts == [1]
+    assert change_set.deletes == []
+
+
+def test_empty_change_set_keeps_the_base_version():
+    change_set = ChangeSet('Opportunities', base_version=42)
+
+    assert change_set.to_dict() == {
+        'entity': 'Opportunities', 'base_version': 42, 'latest_version': 42, 'upserts': [], 'deletes': [],
+    }
+    assert ChangeSet('Opportunities').latest_version is None
+
+
+class FakeFetch:
+    """Stand-in for a request: later IDs complete first, IDs divisible by 5 fail, and the peak concurrency is recorded."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+
+    def __call__(self, object_id):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            time.sleep(0.001 * (20 - object_id % 20))
+            if object_id % 5 == 0:
+                raise ValueError(f'failed {object_id}')
+            return {'Id': object_id}
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+def test_fetch_concurrently_keeps_the_order_of_the_ids():
+    fetch = FakeFetch()
+    failures = []
+
+    results = list(fetch_concurrently(range(1, 61), fetch, max_workers=4, failures=failures))
+
+    assert results == [(object_id, {'Id': object_id}) for object_id in range(1, 61) if object_id % 5]
+    assert failures == [(object_id, f'failed {object_id}') for object_id in range(5, 61, 5)]
+    assert 1 < fetch.peak <= 4
+
+
+def test_iter_entity_objects_fetches_every_id(monkeypatch):
+    fetch = FakeFetch()
+    monkeypatch.setattr(api_utils, 'fetch_api_data', lambda relative_url: fetch(int(relative_url.rsplit('/', 1)[1])))
+    entity = {'Endpoint': 'opportunities', 'Entity': 'Opportunities', 'MaxConcurrency': 3}
+    failures = []
+
+    results = list(iter_entity_objects(entity, {'Opportunities': list(range(1, 21))}, failures, strategy='per_id'))
+
+    assert [object_id for object_id, _ in results] == [1, 2, 3, 4, 6, 7, 8, 9, 11, 12, 13, 14, 16, 17, 18, 19]
+    assert [object_id for object_id, _ in failures] == [5, 10, 15, 20]
+    assert fetch.peak <= 3
+
+
+def test_iter_entity_arrays_stamps_the_object_id(monkeypatch):
+    def fetch_api_data(relative_url):
+        object_id = int(relative_url.split('/')[1])
+        time.sleep(0.001 * (10 - object_id))
+        if object_id == 2:
+            raise ValueError('not found')
+        if object_id == 3:
+            return {'Name': 'single'}
+        return [{'Name': f'{object_id}-a'}, {'Name': f'{object_id}-b'}]
+
+    monkeypatch.setattr(api_utils, 'fetch_api_data', fetch_api_data)
+    entity = {'Endpoint': 'opportunities', 'Entity': 'Opportunities'}
+    failures = []
+
+    items = list(iter_entity_arrays(entity, 'staff', {'Opportunities': [1, 2, 3, 4]}, failures))
+
+    assert items == [
+        {'Name': '1-a', 'ObjectId': 1}, {'Name': '1-b', 'ObjectId': 1},
+        {'Name': 'single', 'ObjectId': 3},
+        {'Name': '4-a', 'ObjectId': 4}, {'Name': '4-b', 'ObjectId': 4},
+    ]
+    assert failures == [(2, 'not found')]
+
+
+def make_response(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response.url = 'https://api/test'
+    response._content = b'{}'
+    return response
+
+
+class StubSession:
+    """Stand-in for the shared session that returns (or raises) the given outcomes in turn."""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def get(self, url, params=None, timeout=None):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(api_utils.time, 'sleep', delays.append)
+    return delays
+
+
+def use_session(monkeypatch, outcomes):
+    session = StubSession(outcomes)
+    monkeypatch.setattr(api_utils, 'get_session', lambda: session)
+    return session
+
+
+@pytest.mark.parametrize('status_code', [429, 503])
+def test_request_with_retry_retries_transient_statuses(monkeypatch, sleeps, status_code):
+    session = use_session(monkeypatch, [make_response(status_code), make_response(status_code), make_response(200)])
+
+    assert request_with_retry('https://api/test').status_code == 200
+    assert session.calls == 3
+    assert len(sleeps) == 2
+
+
+def test_request_with_retry_raises_other_statuses_at_once(monkeypatch, sleeps):
+    session = use_session(monkeypatch, [make_response(404), make_response(200)])
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        request_with_retry('https://api/test')
+    assert session.calls == 1
+    assert sleeps == []
+
+
+def test_request_with_retry_gives_up_after_max_retries(monkeypatch, sleeps):
+    monkeypatch.setattr(api_utils, 'max_retries', 2)
+    session = use_session(monkeypatch, [make_response(503)] * 5)
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        request_with_retry('https://api/test')
+    assert session.calls == 3
+    assert len(sleeps) == 2
+
+
+def test_request_with_retry_retries_connection_errors(monkeypatch, sleeps):
+    session = use_session(monkeypatch, [requests.exceptions.ConnectionError('reset'), requests.exceptions.Timeout('slow'), make_response(200)])
+
+    assert request_with_retry('https://api/test').status_code == 200
+    assert session.calls == 3
+
+    monkeypatch.setattr(api_utils, 'max_retries', 1)
+    use_session(monkeypatch, [requests.exceptions.ConnectionError('reset')] * 2)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        request_with_retry('https://api/test')
+
+
+def test_get_retry_delay_honors_retry_after(monkeypatch):
+    monkeypatch.setattr(api_utils, 'backoff_max', 60)
+    retry_at = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+
+    assert get_retry_delay(0, make_response(429, {'Retry-After': '7'})) == 7
+    assert 25 <= get_retry_delay(0, make_response(429, {'Retry-After': retry_at})) <= 30
+    assert get_retry_delay(0, make_response(429, {'Retry-After': '3600'})) == 60
+    assert get_retry_delay(0, make_response(429, {'Retry-After': format_datetime(datetime(2100, 1, 1, tzinfo=timezone.utc), usegmt=True)})) == 60
+
+
+def test_get_retry_delay_backs_off_exponentially(monkeypatch):
+    monkeypatch.setattr(api_utils, 'backoff_base', 1)
+    monkeypatch.setattr(api_utils, 'backoff_max', 10)
+
+    assert all(0 <= get_retry_delay(2) <= 4 for _ in range(100))
+    assert all(0 <= get_retry_delay(10, make_response(503, {'Retry-After': 'soon'})) <= 10 for _ in range(100))
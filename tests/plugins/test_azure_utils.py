@@ -0,0 +1,189 @@
+"""Unit tests for the pure helpers of plugins/azure_utils.py. No storage account or database is used."""
+
+import datetime
+import gzip
+import json
+
+import pytest
+
+from plugins import azure_utils, metrics
+from plugins.azure_utils import (
+    coerce_rows, iter_decompressed, iter_encoded_records, iter_json_items, iter_ndjson, upload_blob_in_blocks,
+)
+
+RECORDS = [
+    {'Id': 1, 'Name': 'Ünïcode ✓', 'Amount': 2.5, 'Exponent': -1.5e-10, 'IsActive': True},
+    {'Id': 2, 'Nested': {'List': [1, 2.0, None], 'Empty': {}}, 'Text': 'brackets ] [ and , commas'},
+    {'Id': 3, 'Escapes': 'quote " backslash \\ newline \n'},
+]
+
+
+def split(data, size):
+    """Splits bytes into chunks of the given size."""
+    return [data[offset:offset + size] for offset in range(0, len(data), size)]
+
+
+def encode(records, landing_format):
+    return b''.join(chunk.encode('UTF-8') if isinstance(chunk, str) else chunk for chunk in iter_encoded_records(records, landing_format))
+
+
+def test_coerce_rows_turns_fractional_integers_into_nulls():
+    columns = [{'name': 'Id', 'type': 'Integer'}]
+    rows = coerce_rows([(1,), (2.0,), (2.5,), ('3',), ('x',), (None,)], columns)
+
+    assert rows == [(1,), (2,), (None,), (3,), (None,), (None,)]
+    assert coerce_rows([(9007199254740993,), (None,)], columns) == [(9007199254740993,), (None,)]
+    assert all(type(value) is int for value, in rows[:2])
+
+
+def test_coerce_rows_maps_known_booleans_and_nulls_the_rest():
+    columns = [{'name': 'IsActive', 'type': 'Boolean'}]
+    rows = coerce_rows([(True,), (False,), (1,), (0,), ('true',), ('FALSE',), ('yes',), (2,), (None,)], columns)
+
+    assert rows == [(True,), (False,), (True,), (False,), (True,), (False,), (None,), (None,), (None,)]
+
+
+def test_coerce_rows_keeps_boolean_columns():
+    columns = [{'name': 'IsActive', 'type': 'Boolean'}]
+
+    assert coerce_rows([(True,), (False,)], columns) == [(True,), (False,)]
+
+
+def test_coerce_rows_converts_datetimes_and_strings():
+    columns = [{'name': 'ModifyDate', 'type': 'DateTime'}, {'name': 'Name', 'type': 'String'}]
+    rows = coerce_rows([('2024-01-01T00:00:00.1234567', 'a'), (None, float('nan')), ('x', {'b': 1})], columns)
+
+    assert rows == [
+        (datetime.datetime(2024, 1, 1, 0, 0, 0, 123456), 'a'),
+        (None, None),
+        (None, '{"b": 1}'),
+    ]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64, 1 << 20])
+def test_iter_json_items_round_trips_at_any_chunk_size(chunk_size):
+    document = encode(RECORDS, 'json')
+
+    assert list(iter_json_items(split(document, chunk_size))) == RECORDS
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3])
+def test_iter_json_items_reads_numbers_cut_by_a_chunk(chunk_size):
+    document = b'[1, 2.5, -3e10, 1E-2, 42, 0.125]'
+
+    assert list(iter_json_items(split(document, chunk_size))) == [1, 2.5, -3e10, 1e-2, 42, 0.125]
+
+
+def test_iter_json_items_handles_empty_arrays_and_other_documents():
+    assert list(iter_json_items([b' [ ', b']'])) == []
+    assert list(iter_json_items([b'{"a"', b': 1}'])) == [{'a': 1}]
+    assert list(iter_json_items([b''])) == []
+
+
+def test_iter_json_items_rejects_a_truncated_array():
+    with pytest.raises(ValueError):
+        list(iter_json_items([b'[{"a": 1}, {"b"']))
+
+
+@pytest.mark.parametrize('landing_format', ['ndjson', 'ndjson.gz', 'ndjson.zst'])
+@pytest.mark.parametrize('chunk_size', [1, 3, 17, 1 << 20])
+def test_ndjson_formats_round_trip_at_any_chunk_size(landing_format, chunk_size):
+    if landing_format == 'ndjson.zst':
+        pytest.importorskip('zstandard')
+    blob = encode(RECORDS, landing_format)
+
+    assert list(iter_ndjson(iter_decompressed(split(blob, chunk_size)))) == RECORDS
+
+
+@pytest.mark.parametrize('landing_format', ['ndjson.gz', 'ndjson.zst'])
+def test_iter_decompressed_reads_concatenated_members(landing_format):
+    if landing_format == 'ndjson.zst':
+        pytest.importorskip('zstandard')
+    blob = encode(RECORDS[:2], landing_format) + encode([], landing_format) + encode(RECORDS[2:], landing_format)
+
+    assert list(iter_ndjson(iter_decompressed(split(blob, 5)))) == RECORDS
+
+
+def test_iter_decompressed_passes_plain_data_through():
+    assert b''.join(iter_decompressed([b'a', b'bcdef'])) == b'abcdef'
+    assert gzip.decompress(encode(RECORDS, 'ndjson.gz')) == encode(RECORDS, 'ndjson')
+
+
+class BlockBlob:
+    """Stand-in for a BlobClient that keeps staged and committed blocks."""
+
+    credential = None
+
+    def __init__(self, container=None, name=None):
+        self.container = container
+        self.name = name
+        self.url = f'https://account/{name}'
+        self.staged = {}
+        self.committed = None
+
+    def stage_block(self, block_id, data, **kwargs):
+        self.staged[block_id] = bytes(data)
+
+    def stage_block_from_url(self, block_id, source_url, source_offset=None, source_length=None, **kwargs):
+        source = self.container.blobs[source_url.rsplit('/', 1)[1]].committed
+        self.staged[block_id] = source[source_offset:source_offset + source_length]
+
+    def commit_block_list(self, block_list, **kwargs):
+        self.committed = b''.join(self.staged[block_id] for block_id in block_list)
+
+    def get_blob_properties(self):
+        return type('BlobProperties', (), {'size': len(self.committed)})()
+
+
+class BlockContainer:
+    def __init__(self):
+        self.blobs = {}
+
+    def get_blob_client(self, name):
+        return self.blobs.setdefault(name, BlockBlob(self, name))
+
+
+def test_upload_blob_in_blocks_stages_bounded_blocks():
+    blob = BlockBlob()
+    data = encode(RECORDS * 20, 'json')
+
+    size = upload_blob_in_blocks(blob, split(data, 7), block_size=100)
+
+    assert size == len(data)
+    assert blob.committed == data
+    assert max(len(block) for block in blob.staged.values()) == 100
+    assert len({len(block_id) for block_id in blob.staged}) == 1
+
+
+def test_upload_blob_in_blocks_creates_empty_blobs():
+    blob = BlockBlob()
+
+    assert upload_blob_in_blocks(blob, []) == 0
+    assert blob.committed == b''
+
+
+def test_upload_blob_in_blocks_counts_encoded_bytes():
+    metrics.reset()
+    chunks = ['Ünïcode ✓', b'bytes', '✓' * 50]
+
+    size = upload_blob_in_blocks(BlockBlob(), chunks, block_size=16)
+
+    assert size == len('Ünïcode ✓bytes'.encode('UTF-8') + ('✓' * 50).encode('UTF-8'))
+    assert metrics.summarize()['blob.upload.bytes']['sum'] == size
+
+
+@pytest.mark.parametrize('landing_format', ['json', 'ndjson', 'ndjson.gz'])
+def test_assemble_blob_concatenates_parts(monkeypatch, landing_format):
+    container = BlockContainer()
+    monkeypatch.setattr(azure_utils, 'get_container_client', lambda container_name: container)
+    parts = [[], RECORDS[:1], [], RECORDS[1:], []]
+    for index, records in enumerate(parts):
+        upload_blob_in_blocks(container.get_blob_client(f'part-{index}'), iter_encoded_records(records, landing_format))
+
+    azure_utils.assemble_blob('container', 'run', [f'part-{index}' for index in range(len(parts))], landing_format)
+
+    run = container.blobs['run'].committed
+    if landing_format == 'json':
+        assert json.loads(run) == RECORDS
+    else:
+        assert list(iter_ndjson(iter_decompressed([run]))) == RECORDS
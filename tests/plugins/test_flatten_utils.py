@@ -0,0 +1,72 @@
+"""Unit tests for plugins/flatten_utils.py."""
+
+import pytest
+
+from plugins.flatten_utils import compile_array_mapping, compile_path, iter_flattened
+
+
+RECORD = {
+    'id': 7,
+    'offices': [{'office': {'id': 1, 'name': 'A'}}, {'office': {'id': 2, 'name': 'B'}}],
+    'team': {'roles': ['lead', 'member']},
+    'empty': [],
+    'nothing': None,
+}
+
+
+@pytest.mark.parametrize('path, matches', [
+    ('$', [RECORD]),
+    ('$.id', [7]),
+    ('$.offices[*].office.id', [1, 2]),
+    ("$.team['roles']", [['lead', 'member']]),
+    ("$.team['roles'][0]", ['lead']),
+    ('$.team.roles[-1]', ['member']),
+    ('$.offices[5]', []),
+    ('$.empty[*]', []),
+])
+def test_compile_path_finds_the_matches(path, matches):
+    assert compile_path(path)(RECORD) == (matches, True)
+
+
+def test_compile_path_reports_a_missing_path():
+    assert compile_path('$.missing[*]')(RECORD) == ([], False)
+    assert compile_path('$.offices[*].missing')(RECORD) == ([], False)
+
+
+@pytest.mark.parametrize('path', ['offices', '$.offices[', '$..offices', '$.offices[?(@.id)]'])
+def test_compile_path_rejects_unsupported_expressions(path):
+    with pytest.raises(ValueError):
+        compile_path(path)
+
+
+def test_array_mapping_takes_items_as_they_are():
+    extract = compile_array_mapping('$.offices[*].office')
+
+    items = extract(RECORD)
+    assert items == [{'id': 1, 'name': 'A'}, {'id': 2, 'name': 'B'}]
+    # Items are copies, so stamping them leaves the parent record alone
+    items[0]['ObjectId'] = 7
+    assert 'ObjectId' not in RECORD['offices'][0]['office']
+
+
+def test_array_mapping_projects_fields():
+    extract = compile_array_mapping({'path': '$.offices[*]', 'fields': {'OfficeId': '$.office.id', 'Missing': '$.nope'}})
+
+    assert extract(RECORD) == [{'OfficeId': 1, 'Missing': None}, {'OfficeId': 2, 'Missing': None}]
+
+
+def test_array_mapping_treats_lists_and_null_like_the_endpoint():
+    assert compile_array_mapping('$.team.roles')(RECORD) == ['lead', 'member']
+    assert compile_array_mapping('$.empty')(RECORD) == []
+    assert compile_array_mapping('$.nothing')(RECORD) == []
+    assert compile_array_mapping('$.missing')(RECORD) is None
+
+
+def test_iter_flattened_stamps_items_and_collects_missing_parents():
+    extract = compile_array_mapping('$.offices[*].office')
+    missing_ids = []
+
+    items = list(iter_flattened([(7, RECORD), (8, {'id': 8})], extract, missing_ids))
+
+    assert [item['ObjectId'] for item in items] == [7, 7]
+    assert missing_ids == [8]
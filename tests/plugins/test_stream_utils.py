@@ -0,0 +1,63 @@
+"""Unit tests for the producer/consumer helpers of plugins/stream_utils.py."""
+
+import threading
+
+import pytest
+
+from plugins.stream_utils import iter_fanout, iter_prefetched
+
+
+def consume_in_threads(streams):
+    """Consumes every stream in its own thread, returning the items or exception of each."""
+    results = [None] * len(streams)
+
+    def consume(index):
+        try:
+            results[index] = list(streams[index])
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=consume, args=(index,)) for index in range(len(streams))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+    return results
+
+
+def test_iter_fanout_hands_every_item_to_every_consumer():
+    streams = iter_fanout(range(1000), 3, max_items=10)
+
+    assert consume_in_threads(streams) == [list(range(1000))] * 3
+
+
+def test_iter_fanout_raises_producer_errors_in_every_consumer():
+    def produce():
+        yield 1
+        raise KeyError('broken')
+
+    results = consume_in_threads(iter_fanout(produce(), 2))
+
+    assert all(isinstance(result, KeyError) for result in results)
+
+
+def test_iter_fanout_stops_when_a_consumer_is_closed():
+    streams = iter_fanout(range(1000), 2, max_items=5)
+    streams[0].close()
+
+    results = consume_in_threads(streams[1:])
+
+    assert isinstance(results[0], RuntimeError)
+
+
+def test_iter_prefetched_keeps_the_order_and_raises_producer_errors():
+    def produce():
+        yield from range(100)
+        raise KeyError('broken')
+
+    items = []
+    with pytest.raises(KeyError):
+        for item in iter_prefetched(produce(), max_items=3):
+            items.append(item)
+
+    assert items == list(range(100))